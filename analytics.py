@@ -0,0 +1,157 @@
+#!/usr/bin/env python
+
+"""
+analytics.py -- hourly and daily conference statistics rollups
+
+Registrations, wishlistings and session writes enqueue events to a pull
+queue in the transaction of the write. The fold cron leases them in bulk,
+sums them per conference into metric deltas and adds those, once per
+task, with pullqueue.foldDeltas to StatsRollup entities: one per
+conference and hour, one per conference and day, and the conference's
+totals. A conference's statistics are then one get_multi
+of known keys, however many registrations and sessions it has.
+
+Metrics are 'registrations', 'sessions' and 'wishlists', and the latter
+two broken down as '<metric>.type.<typeOfSession>' and
+'<metric>.day.<dayofConf>'.
+
+"""
+
+import json
+import time
+from collections import Counter
+from datetime import datetime
+from datetime import timedelta
+
+from google.appengine.ext import ndb
+
+import pullqueue
+from models import StatsRollup
+
+STATS_QUEUE = 'stats-events'
+HOURS_SHOWN = 48
+DAYS_SHOWN = 30
+
+
+def registrationEvent(conf_key, delta):
+    """Return the event of a registration (1) or unregistration (-1)."""
+    return {'type': 'registration', 'conference': conf_key.urlsafe(),
+            'delta': delta, 'time': int(time.time())}
+
+
+def wishlistEvent(s_key):
+    """Return the event of a wishlisting of a Session."""
+    return {'type': 'wishlist', 'session': s_key.urlsafe(),
+            'time': int(time.time())}
+
+
+def sessionEvents(sessions, removed=()):
+    """
+    Return the events of new/updated sessions (1) and of the previous
+    versions of updated sessions and deleted sessions (-1).
+    """
+    now = int(time.time())
+    events = []
+    for group, delta in ((sessions, 1), (removed, -1)):
+        events.extend({'type': 'session',
+                       'conference': session.key.parent().urlsafe(),
+                       'typeOfSession': session.typeOfSession,
+                       'dayofConf': session.dayofConf,
+                       'delta': delta, 'time': now} for session in group)
+    return events
+
+
+def recordEvents(events):
+    """Buffer events, see pullqueue.add."""
+    if events:
+        pullqueue.add(STATS_QUEUE, json.dumps(events))
+
+
+def _breakdown(metric, typeOfSession, dayofConf, delta):
+    return {metric: delta,
+            '%s.type.%s' % (metric, typeOfSession): delta,
+            '%s.day.%s' % (metric, dayofConf): delta}
+
+
+def _metrics(event, sessions):
+    """Return (Conference key, {metric: delta}) of an event, None if moot."""
+    if event['type'] == 'registration':
+        return ndb.Key(urlsafe=event['conference']), \
+            {'registrations': event['delta']}
+    if event['type'] == 'session':
+        return ndb.Key(urlsafe=event['conference']), _breakdown(
+            'sessions', event['typeOfSession'], event['dayofConf'],
+            event['delta'])
+    # a wishlisting counts under the type and day of its session
+    session = sessions.get(event['session'])
+    if not session:
+        return None
+    return session.key.parent(), _breakdown(
+        'wishlists', session.typeOfSession, session.dayofConf, 1)
+
+
+def foldEvents():
+    """
+    Add one batch of buffered events to the rollups, returning the
+    number of tasks folded.
+    """
+    return pullqueue.foldDeltas(STATS_QUEUE, _eventDeltas, _addCounts)[0]
+
+
+def _eventDeltas(tasks):
+    """Return {StatsRollup key: [(task name, {metric: delta}), ...]}."""
+    batches = [(task.name, json.loads(task.payload)) for task in tasks]
+    wssks = list(set(event['session'] for name, events in batches
+                     for event in events if event['type'] == 'wishlist'))
+    sessions = dict(zip(wssks, ndb.get_multi(
+        [ndb.Key(urlsafe=wssk) for wssk in wssks])))
+
+    deltas = {}
+    for name, events in batches:
+        task_deltas = {}
+        for event in events:
+            found = _metrics(event, sessions)
+            if not found:
+                continue
+            conf_key, metrics = found
+            when = datetime.utcfromtimestamp(event['time'])
+            for period in ('hour', 'day', 'total'):
+                task_deltas.setdefault(
+                    StatsRollup.keyFor(conf_key, period, when),
+                    Counter()).update(metrics)
+        for key, delta in task_deltas.items():
+            deltas.setdefault(key, []).append((name, delta))
+    return deltas
+
+
+def _addCounts(key, rollup, deltas):
+    rollup = rollup or StatsRollup(key=key, counts={})
+    counts = Counter(rollup.counts)
+    for delta in deltas:
+        counts.update(delta)
+    rollup.counts = dict(counts)
+    return rollup
+
+
+def rollupKeys(conf_key, now=None):
+    """
+    Return the keys of the rollups getConferenceStats shows: the total,
+    the last HOURS_SHOWN hours and the last DAYS_SHOWN days, oldest first.
+    """
+    now = now or datetime.utcnow()
+    return ([StatsRollup.keyFor(conf_key, 'total')] +
+            [StatsRollup.keyFor(conf_key, 'hour', now - timedelta(hours=i))
+             for i in reversed(range(HOURS_SHOWN))] +
+            [StatsRollup.keyFor(conf_key, 'day', now - timedelta(days=i))
+             for i in reversed(range(DAYS_SHOWN))])
+
+
+def breakdown(counts, metric, by):
+    """Return [(value, count)] of a metric broken down by 'type' or 'day'."""
+    prefix = '%s.%s.' % (metric, by)
+    items = [(name[len(prefix):], count) for name, count in counts.items()
+             if name.startswith(prefix) and count]
+    if by == 'day':
+        # in day order, not string order
+        return sorted(items, key=lambda item: item[0].zfill(4))
+    return sorted(items)
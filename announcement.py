@@ -0,0 +1,93 @@
+#!/usr/bin/env python
+
+"""
+announcement.py -- the nearly sold out conferences announcement
+
+The conferences with 0 < seatsAvailable <= NEARLY_SOLD_OUT are kept in a
+NearlySoldOut entity. refresh() updates it when a conference's seats or
+name change, and the announcement in memcache is rebuilt only when the
+set actually changes. Registrations reach seatsAvailable through the
+seat fold, which calls refresh(). The daily cron runs rebuild() to
+reconcile the set with a query, in case an update was missed.
+
+"""
+
+from google.appengine.api import memcache
+from google.appengine.ext import ndb
+
+from models import Conference
+from models import NearlySoldOut
+
+NEARLY_SOLD_OUT = 5  # seats
+MEMCACHE_ANNOUNCEMENTS_KEY = "RECENT_ANNOUNCEMENTS"
+ANNOUNCEMENT_TPL = ('Last chance to attend! The following conferences '
+                    'are nearly sold out: %s')
+
+
+def isNearlySoldOut(seats):
+    return seats is not None and 0 < seats <= NEARLY_SOLD_OUT
+
+
+def _announce(conferences):
+    """Set the announcement of {websafeKey: name} in memcache and return it."""
+    if conferences:
+        announcement = ANNOUNCEMENT_TPL % (
+            ', '.join(sorted(conferences.values())))
+        memcache.set(MEMCACHE_ANNOUNCEMENTS_KEY, announcement)
+    else:
+        announcement = ""
+        memcache.delete(MEMCACHE_ANNOUNCEMENTS_KEY)
+    return announcement
+
+
+def refresh(wsck, name, seats):
+    """
+    Add a conference to or remove it from the nearly sold out set after
+    its seatsAvailable or name changed; rebuild the announcement if the
+    set changed.
+    """
+    key = NearlySoldOut.keyFor()
+
+    @ndb.transactional()
+    def update():
+        entity = key.get() or NearlySoldOut(key=key, conferences={})
+        conferences = dict(entity.conferences or {})
+        if isNearlySoldOut(seats):
+            conferences[wsck] = name
+        else:
+            conferences.pop(wsck, None)
+        if conferences == (entity.conferences or {}):
+            return None
+        entity.conferences = conferences
+        entity.put()
+        return conferences
+
+    # most changes leave the set alone; check without a transaction first
+    entity = key.get()
+    current = (entity.conferences or {}) if entity else {}
+    if isNearlySoldOut(seats) == (wsck in current) and \
+            current.get(wsck, name) == name:
+        return
+    conferences = update()
+    if conferences is not None:
+        _announce(conferences)
+
+
+def rebuild():
+    """Rebuild the set and the announcement from a query; return it."""
+    confs = Conference.query(ndb.AND(
+        Conference.seatsAvailable <= NEARLY_SOLD_OUT,
+        Conference.seatsAvailable > 0)
+    ).fetch(projection=[Conference.name])
+    conferences = dict((conf.key.urlsafe(), conf.name) for conf in confs)
+    NearlySoldOut(key=NearlySoldOut.keyFor(), conferences=conferences).put()
+    return _announce(conferences)
+
+
+def current():
+    """Return the announcement, rebuilding it from the set if evicted."""
+    announcement = memcache.get(MEMCACHE_ANNOUNCEMENTS_KEY)
+    if announcement is None:
+        entity = NearlySoldOut.keyFor().get()
+        announcement = _announce(entity.conferences if entity else {})
+    return announcement
@@ -0,0 +1,153 @@
+#!/usr/bin/env python
+
+"""
+api_bench.py -- ConferenceApi benchmark against the App Engine stubs
+
+Seeds conferences, sessions and profiles, then times queryConferences,
+getQuerySessions, registerForConference, createSession and
+getMostWishlisted. Prints one JSON document with the latency percentiles,
+the RPCs per call and the entities read/written per call of each.
+
+usage: python benchmarks/api_bench.py --sdk PATH_TO_SDK
+           [--conferences 50] [--sessions 20] [--profiles 200]
+           [--iterations 100] [--seed 42] [--output FILE]
+
+"""
+
+import argparse
+import json
+import random
+
+import harness
+
+CITIES = ['London', 'Paris', 'Tokyo', 'Chicago', 'Berlin']
+TOPICS = ['Medical Innovations', 'Programming Languages', 'Web Technologies']
+SPEAKERS = ['ada lovelace', 'alan turing', 'grace hopper', 'linus torvalds']
+
+
+def seed(args):
+    """Store the benchmark data set; return profile emails and conference keys."""
+    from datetime import date
+    from google.appengine.ext import ndb
+    from models import Conference
+    from models import Profile
+    from models import Session
+    import seats
+
+    rnd = random.Random(args.seed)
+    emails = ['user%d@gmail.com' % i for i in range(args.profiles)]
+    ndb.put_multi([Profile(key=ndb.Key(Profile, email), displayName=email,
+                           mainEmail=email) for email in emails])
+
+    conf_keys = []
+    entities = []
+    for i in range(args.conferences):
+        organizer = emails[i % len(emails)]
+        conf_key = ndb.Key(Conference, i + 1, parent=ndb.Key(Profile, organizer))
+        shards = seats.makeSeatShards(conf_key, args.profiles)
+        start = date(2016, rnd.randint(1, 12), 1)
+        entities.extend(shards)
+        entities.append(Conference(key=conf_key, name='Conference %d' % i,
+            description='Benchmark conference %d' % i,
+            organizerUserId=organizer, topics=rnd.sample(TOPICS, 2),
+            city=rnd.choice(CITIES), startDate=start, month=start.month,
+            maxAttendees=args.profiles, seatsAvailable=args.profiles,
+            seatShards=len(shards)))
+        for j in range(args.sessions):
+            entities.append(Session(parent=conf_key, name='Session %d' % j,
+                highlights='Highlights of session %d' % j,
+                speaker=rnd.choice(SPEAKERS), duration=rnd.choice([30, 60, 90]),
+                typeOfSession=rnd.choice(['LECTURE', 'KEYNOTE', 'WORKSHOP']),
+                dayofConf=rnd.randint(1, 3), startTime=rnd.randint(8, 20),
+                wishlisted=rnd.randint(0, 50)))
+        conf_keys.append(conf_key)
+    ndb.put_multi(entities)
+    return emails, conf_keys
+
+
+def run(args):
+    from protorpc import message_types
+    import conference
+    from conference import ConferenceApi
+    from models import ConferenceQueryForm
+    from models import ConferenceQueryForms
+    from models import SessionQueryForm
+
+    tb = harness.activateTestbed()
+    counter = harness.RpcCounter()
+    counter.install()
+    emails, conf_keys = seed(args)
+    rnd = random.Random(args.seed)
+    n = args.iterations
+
+    def queryConferences(i):
+        harness.signIn(rnd.choice(emails))
+        ConferenceApi().queryConferences(ConferenceQueryForms(filters=[
+            ConferenceQueryForm(field='CITY', operator='EQ',
+                                value=rnd.choice(CITIES))]))
+
+    def getQuerySessions(i):
+        request = conference.QUERY_POST_REQUEST.combined_message_class(
+            websafeConferenceKey=rnd.choice(conf_keys).urlsafe(),
+            filters=[SessionQueryForm(field='TYPE', operator='NE',
+                                      value='WORKSHOP'),
+                     SessionQueryForm(field='START_TIME', operator='LT',
+                                      value='19')])
+        ConferenceApi().getQuerySessions(request)
+
+    def registerForConference(i):
+        # a different (profile, conference) pair every call
+        harness.signIn(emails[i % len(emails)])
+        conf_key = conf_keys[(i // len(emails)) % len(conf_keys)]
+        request = conference.CONF_GET_REQUEST.combined_message_class(
+            websafeConferenceKey=conf_key.urlsafe())
+        ConferenceApi().registerForConference(request)
+
+    def createSession(i):
+        conf_key = conf_keys[i % len(conf_keys)]
+        harness.signIn(conf_key.parent().id())
+        request = conference.SESS_POST_REQUEST.combined_message_class(
+            websafeConferenceKey=conf_key.urlsafe(), name='New session %d' % i,
+            speaker=rnd.choice(SPEAKERS), duration=60, startTime=10,
+            dayofConf=1)
+        ConferenceApi().createSession(request)
+
+    def getMostWishlisted(i):
+        ConferenceApi().getMostWishlisted(message_types.VoidMessage())
+
+    results = [harness.timeCalls(fn.__name__, fn, n, counter) for fn in (
+        queryConferences, getQuerySessions, registerForConference,
+        createSession, getMostWishlisted)]
+    tb.deactivate()
+    return {
+        'benchmark': 'api_bench',
+        'conferences': args.conferences,
+        'sessions_per_conference': args.sessions,
+        'profiles': args.profiles,
+        'results': results,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--sdk', required=True,
+                        help='path to the App Engine Python SDK')
+    parser.add_argument('--conferences', type=int, default=50)
+    parser.add_argument('--sessions', type=int, default=20)
+    parser.add_argument('--profiles', type=int, default=200)
+    parser.add_argument('--iterations', type=int, default=100)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--output', help='write the JSON here, not to stdout')
+    args = parser.parse_args()
+
+    harness.setupSdk(args.sdk)
+    report = json.dumps(run(args), indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(report + '\n')
+    else:
+        print(report)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,118 @@
+#!/usr/bin/env python
+
+"""
+harness.py -- shared setup of the ConferenceApi benchmarks
+
+Puts the App Engine SDK on sys.path, activates the testbed stubs, signs
+users in the way Cloud Endpoints does, and counts the API calls and the
+entities read and written by each timed call.
+
+"""
+
+import os
+import sys
+import time
+from collections import Counter
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def setupSdk(sdk_path):
+    """Put the App Engine SDK and the app on sys.path."""
+    sys.path.insert(0, sdk_path)
+    import dev_appserver
+    dev_appserver.fix_sys_path()
+    sys.path.insert(0, ROOT)
+
+
+def activateTestbed():
+    """Activate the datastore, memcache and taskqueue stubs."""
+    from google.appengine.datastore import datastore_stub_util
+    from google.appengine.ext import ndb
+    from google.appengine.ext import testbed
+
+    tb = testbed.Testbed()
+    tb.activate()
+    tb.init_datastore_v3_stub(consistency_policy=datastore_stub_util.
+        PseudoRandomHRConsistencyPolicy(probability=1))
+    tb.init_memcache_stub()
+    tb.init_taskqueue_stub(root_path=ROOT)
+    ndb.get_context().clear_cache()
+    return tb
+
+
+def signIn(email):
+    """Make endpoints.get_current_user() return the user of email."""
+    os.environ['ENDPOINTS_AUTH_EMAIL'] = email
+    os.environ['ENDPOINTS_AUTH_DOMAIN'] = 'gmail.com'
+
+
+class RpcCounter(object):
+    """Counts API calls by service.method, and datastore entity reads/writes."""
+
+    def __init__(self):
+        self.calls = Counter()
+        self.reads = 0
+        self.writes = 0
+
+    def install(self):
+        from google.appengine.api import apiproxy_stub_map
+        apiproxy_stub_map.apiproxy.GetPostCallHooks().Append(
+            'benchmark_counter', self._hook)
+
+    def _hook(self, service, call, request, response):
+        self.calls['%s.%s' % (service, call)] += 1
+        if service != 'datastore_v3':
+            return
+        if call == 'Get':
+            self.reads += request.key_size()
+        elif call in ('RunQuery', 'Next'):
+            self.reads += response.result_size()
+        elif call == 'Put':
+            self.writes += request.entity_size()
+        elif call == 'Delete':
+            self.writes += request.key_size()
+
+    def snapshot(self):
+        return Counter(self.calls), self.reads, self.writes
+
+
+def percentile(values, pct):
+    """Return the nearest-rank percentile of values."""
+    ordered = sorted(values)
+    rank = max(0, int(round(pct / 100.0 * len(ordered))) - 1)
+    return ordered[rank]
+
+
+def timeCalls(name, fn, iterations, counter):
+    """
+    Call fn() iterations times as separate requests and return its
+    latency percentiles (ms) and per-call RPC and entity counts.
+    """
+    from google.appengine.ext import ndb
+
+    timings = []
+    calls, reads, writes = counter.snapshot()
+    for i in range(iterations):
+        # every call is a new request, with a cold in-context cache
+        ndb.get_context().clear_cache()
+        start = time.time()
+        fn(i)
+        timings.append((time.time() - start) * 1000)
+    after_calls, after_reads, after_writes = counter.snapshot()
+
+    per_call = dict((rpc, round(float(count) / iterations, 2))
+                    for rpc, count in (after_calls - calls).items())
+    return {
+        'name': name,
+        'iterations': iterations,
+        'latency_ms': {
+            'p50': round(percentile(timings, 50), 3),
+            'p90': round(percentile(timings, 90), 3),
+            'p99': round(percentile(timings, 99), 3),
+            'max': round(max(timings), 3),
+        },
+        'rpcs_per_call': per_call,
+        'entity_reads_per_call': round(float(after_reads - reads) / iterations, 2),
+        'entity_writes_per_call': round(float(after_writes - writes) / iterations, 2),
+    }
@@ -0,0 +1,124 @@
+#!/usr/bin/env python
+
+"""
+registration_load.py -- registrations/sec for one hot conference
+
+Runs concurrent registrations for a single conference against the App
+Engine testbed stubs, once with the previous single-entity transaction
+("legacy") and once with the sharded seat counter in seats.py, and
+prints one JSON line per mode.
+
+usage: python benchmarks/registration_load.py --sdk PATH_TO_SDK
+           [--threads 20] [--registrations 1000] [--seats 1000]
+
+"""
+
+import argparse
+import json
+import threading
+import time
+
+import harness
+
+
+def legacyRegister(conf_key, prof_key):
+    """Registration as done before seat sharding."""
+    from google.appengine.ext import ndb
+    from models import ConflictException
+
+    @ndb.transactional(xg=True)
+    def register():
+        conf, prof = ndb.get_multi([conf_key, prof_key])
+        if conf.seatsAvailable <= 0:
+            raise ConflictException("There are no seats available.")
+        prof.conferenceKeysToAttend.append(conf_key.urlsafe())
+        conf.seatsAvailable -= 1
+        ndb.put_multi([conf, prof])
+        return True
+    return register()
+
+
+def shardedRegister(conf_key, prof_key):
+    """Registration through the sharded seat counter."""
+    import seats
+    return seats.reserveSeat(conf_key.get(), prof_key)
+
+
+def run(mode, args):
+    """Register args.registrations profiles from args.threads threads."""
+    from google.appengine.ext import ndb
+    from models import Conference
+    from models import Profile
+    import seats
+
+    tb = harness.activateTestbed()
+    ndb.get_context().set_cache_policy(False)
+
+    organizer = ndb.Key(Profile, 'organizer@example.com')
+    conf_key = ndb.Key(Conference, 1, parent=organizer)
+    conf = Conference(key=conf_key, name='Hot conference',
+                      maxAttendees=args.seats, seatsAvailable=args.seats)
+    if mode == 'sharded':
+        shards = seats.makeSeatShards(conf_key, args.seats)
+        ndb.put_multi(shards)
+        conf.seatShards = len(shards)
+    conf.put()
+
+    prof_keys = [ndb.Key(Profile, 'user%d@example.com' % i)
+                 for i in range(args.registrations)]
+    ndb.put_multi([Profile(key=key) for key in prof_keys])
+
+    register = legacyRegister if mode == 'legacy' else shardedRegister
+    counts = {'ok': 0, 'failed': 0}
+    lock = threading.Lock()
+
+    def worker(keys):
+        ndb.get_context().set_cache_policy(False)
+        for prof_key in keys:
+            try:
+                register(conf_key, prof_key)
+                result = 'ok'
+            except Exception:
+                result = 'failed'
+            with lock:
+                counts[result] += 1
+
+    threads = [threading.Thread(target=worker,
+                                args=(prof_keys[i::args.threads],))
+               for i in range(args.threads)]
+    start = time.time()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.time() - start
+    tb.deactivate()
+
+    return {
+        'benchmark': 'registration_load',
+        'mode': mode,
+        'threads': args.threads,
+        'registrations': args.registrations,
+        'succeeded': counts['ok'],
+        'failed': counts['failed'],
+        'seconds': round(elapsed, 3),
+        'registrations_per_sec': round(counts['ok'] / elapsed, 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--sdk', required=True,
+                        help='path to the App Engine Python SDK')
+    parser.add_argument('--threads', type=int, default=20)
+    parser.add_argument('--registrations', type=int, default=1000)
+    parser.add_argument('--seats', type=int, default=1000)
+    args = parser.parse_args()
+
+    harness.setupSdk(args.sdk)
+    for mode in ('legacy', 'sharded'):
+        print(json.dumps(run(mode, args)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,105 @@
+#!/usr/bin/env python
+
+"""
+serialize_bench.py -- per-row cost of copying Sessions to SessionForms
+
+Copies the same in-memory Sessions to SessionForms with the previous
+all_fields() loop ("legacy") and with mappers.SESSION.copyMany, then
+encodes the SessionForms response, and prints one JSON line per mode
+with the microseconds per row.
+
+usage: python benchmarks/serialize_bench.py --sdk PATH_TO_SDK
+           [--sessions 10000] [--repeat 5]
+
+"""
+
+import argparse
+import json
+import time
+
+import harness
+
+
+def legacyCopy(session):
+    """Session to SessionForm as done before the precompiled mappers."""
+    from models import SessionForm
+    from models import TypeOfSession
+
+    sf = SessionForm()
+    for field in sf.all_fields():
+        if hasattr(session, field.name):
+            if field.name == "typeOfSession":
+                setattr(sf, field.name,
+                        getattr(TypeOfSession, getattr(session, field.name)))
+            else:
+                setattr(sf, field.name, getattr(session, field.name))
+    sf.check_initialized()
+    return sf
+
+
+def makeSessions(count):
+    from google.appengine.ext import ndb
+    from models import Session
+
+    conf_key = ndb.Key('Profile', 'organizer@example.com', 'Conference', 1)
+    return [Session(key=ndb.Key(Session, i + 1, parent=conf_key),
+                    name='Session %d' % i, highlights='Highlights %d' % i,
+                    speaker='grace hopper', duration=60,
+                    typeOfSession=('LECTURE', 'KEYNOTE', 'WORKSHOP')[i % 3],
+                    dayofConf=i % 3 + 1, startTime=8 + i % 12,
+                    wishlisted=i % 50)
+            for i in range(count)]
+
+
+def best(fn, repeat):
+    """Return the fastest of repeat runs of fn(), in seconds."""
+    timings = []
+    for i in range(repeat):
+        start = time.time()
+        fn()
+        timings.append(time.time() - start)
+    return min(timings)
+
+
+def run(args):
+    from protorpc import protojson
+    import mappers
+    from models import SessionForms
+
+    tb = harness.activateTestbed()
+    sessions = makeSessions(args.sessions)
+    modes = [
+        ('legacy', lambda: [legacyCopy(s) for s in sessions]),
+        ('mapper', lambda: mappers.SESSION.copyMany(sessions)),
+    ]
+    results = []
+    for mode, copy in modes:
+        forms = SessionForms(sessions=copy())
+        copy_s = best(copy, args.repeat)
+        encode_s = best(lambda: protojson.encode_message(forms), args.repeat)
+        results.append({
+            'benchmark': 'serialize_bench',
+            'mode': mode,
+            'sessions': args.sessions,
+            'copy_us_per_row': round(copy_s * 1e6 / args.sessions, 3),
+            'encode_us_per_row': round(encode_s * 1e6 / args.sessions, 3),
+        })
+    tb.deactivate()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--sdk', required=True,
+                        help='path to the App Engine Python SDK')
+    parser.add_argument('--sessions', type=int, default=10000)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    harness.setupSdk(args.sdk)
+    for result in run(args):
+        print(json.dumps(result, sort_keys=True))
+
+
+if __name__ == '__main__':
+    main()
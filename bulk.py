@@ -0,0 +1,414 @@
+#!/usr/bin/env python
+
+"""
+bulk.py -- streamed bulk import and export of Conferences and Sessions
+
+A file holds one kind, as newline-delimited JSON (one object per line) or
+CSV with a header row. An import reads the uploaded blob from the byte
+offset its BulkJob reached, IMPORT_BATCH records per task, and stores them
+with put_multi. An export pages through the kind with a cursor and writes
+the records into BulkPart entities of about PART_BYTES, one per task.
+Every task saves where the job stopped and chains the next step, so jobs
+survive task retries and instance restarts, and memory is bounded by one
+batch whatever the size of the catalog.
+
+Imported records keep their websafeKey when they have one, so importing
+an export again overwrites instead of duplicating; other records get ids
+made of the job id and their byte offset, so a retried batch does too.
+An overwritten entity keeps the counters the app maintains (KEPT_FIELDS),
+and an overwritten Session leaves the Speaker it no longer has.
+What an import derives from a batch is idempotent as well: the caches
+are invalidated and the featured speaker indexes dropped before the step
+is saved, and the search and Speaker index tasks are enqueued in the
+transaction that saves it, so they run once per batch.
+
+"""
+
+import cStringIO
+import csv
+import json
+import logging
+from datetime import date
+from datetime import datetime
+
+from google.appengine.api import taskqueue
+from google.appengine.datastore.datastore_query import Cursor
+from google.appengine.ext import blobstore
+from google.appengine.ext import ndb
+
+import confcache
+import fulltext
+import querycache
+import speakers
+from models import BulkJob
+from models import BulkPart
+from models import Conference
+from models import Profile
+from models import Session
+from models import Speaker
+from models import SpeakerIndex
+from models import TypeOfSession
+
+STEP_TASK_URL = '/tasks/bulk_step'
+IMPORT_BATCH = 200  # records per import task
+EXPORT_BATCH = 100  # entities per export query page
+PART_BYTES = 256 * 1024  # an export part is at most this plus one page
+READ_BUFFER = 128 * 1024
+LIST_SEPARATOR = ';'  # of repeated values in CSV
+
+RUNNING = 'running'
+DONE = 'done'
+
+KINDS = {'Conference': Conference, 'Session': Session}
+FORMATS = {'ndjson': 'application/x-ndjson', 'csv': 'text/csv'}
+FIELDS = {
+    'Conference': ('websafeKey', 'name', 'description', 'organizerUserId',
+                   'organizerDisplayName', 'topics', 'city', 'startDate',
+                   'endDate', 'maxAttendees', 'seatsAvailable'),
+    'Session': ('websafeKey', 'websafeConferenceKey', 'name', 'highlights',
+                'speaker', 'duration', 'typeOfSession', 'dayofConf',
+                'startTime', 'wishlisted'),
+}
+KEY_FIELDS = ('websafeKey', 'websafeConferenceKey')
+# kept from the existing entity when a record overwrites it
+KEPT_FIELDS = {'Conference': ('seatShards',), 'Session': ('wishlisted',)}
+INTEGER_FIELDS = ('maxAttendees', 'seatsAvailable', 'duration', 'dayofConf',
+                  'startTime', 'wishlisted')
+DATE_FIELDS = ('startDate', 'endDate')
+LIST_FIELDS = ('topics',)
+
+
+def _check(kind, format):
+    if kind not in KINDS:
+        raise ValueError('kind must be one of %s' % ', '.join(sorted(KINDS)))
+    if format not in FORMATS:
+        raise ValueError('format must be one of %s' %
+                         ', '.join(sorted(FORMATS)))
+
+
+def startImport(kind, format, blob_key):
+    """Start importing an uploaded file; return its BulkJob."""
+    _check(kind, format)
+    job = BulkJob(operation='import', kind=kind, format=format,
+                  blobKey=blob_key)
+    job.put()
+    _enqueueStep(job)
+    return job
+
+
+def startExport(kind, format):
+    """Start exporting every entity of kind; return its BulkJob."""
+    _check(kind, format)
+    job = BulkJob(operation='export', kind=kind, format=format)
+    job.put()
+    _enqueueStep(job)
+    return job
+
+
+def _enqueueStep(job):
+    """Run the next step of a job, once even if the current one is retried."""
+    try:
+        taskqueue.add(url=STEP_TASK_URL,
+                      params={'job': job.key.id(), 'step': job.step},
+                      name='bulk-%s-%d-%d' % (job.operation, job.key.id(),
+                                              job.step))
+    except (taskqueue.TaskAlreadyExistsError, taskqueue.TombstonedTaskError):
+        pass
+
+
+def runStep(job_id, step):
+    """Run one step of a job and chain the next one while it is running."""
+    job = BulkJob.get_by_id(job_id)
+    if not job or job.status != RUNNING:
+        return
+    if job.step != step:
+        # a retried task of a step already done, which may have failed
+        # to chain the next one; the task name dedupes it otherwise
+        if job.step > step:
+            _enqueueStep(job)
+        return
+    if job.operation == 'import':
+        _importBatch(job)
+    else:
+        _exportBatch(job)
+    if job.status == RUNNING:
+        _enqueueStep(job)
+
+
+# - - - import - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+
+def _readRecords(reader, job):
+    """
+    Yield (byte offset, raw record) from the reader's position on: lines
+    of NDJSON, or dicts of CSV rows, reading the CSV header first at the
+    start of the file.
+    """
+    lines = iter(reader.readline, '')
+    if job.format == 'csv':
+        # csv pulls one line at a time, so tell() stays at the row read
+        rows = csv.reader(lines)
+        if not job.columns:
+            job.columns = [column.decode('utf-8').strip()
+                           for column in next(rows, [])]
+        start = reader.tell()
+        for row in rows:
+            if any(cell.strip() for cell in row):
+                yield start, dict(zip(job.columns,
+                                      [cell.decode('utf-8') for cell in row]))
+            start = reader.tell()
+    else:
+        start = reader.tell()
+        for line in lines:
+            if line.strip():
+                yield start, line
+            start = reader.tell()
+
+
+def _value(field, value):
+    """Return an imported value as the property's type, None if empty."""
+    if value is None or value == '' or value == []:
+        return None
+    if field in INTEGER_FIELDS:
+        return int(value)
+    if field in DATE_FIELDS:
+        return datetime.strptime(value[:10], "%Y-%m-%d").date()
+    if field in LIST_FIELDS:
+        if not isinstance(value, list):
+            value = value.split(LIST_SEPARATOR)
+        return [item.strip() for item in value if item.strip()]
+    return value
+
+
+def _entity(job, offset, record):
+    """Return the entity of an import record; raise ValueError if invalid."""
+    if job.format == 'ndjson':
+        record = json.loads(record)
+    data = {}
+    for field in FIELDS[job.kind]:
+        if field not in KEY_FIELDS:
+            value = _value(field, record.get(field))
+            if value is not None:
+                data[field] = value
+    if not data.get('name'):
+        raise ValueError("'name' field required")
+
+    import_id = 'import-%d-%d' % (job.key.id(), offset)
+    if record.get('websafeKey'):
+        key = ndb.Key(urlsafe=record['websafeKey'])
+        if key.kind() != job.kind:
+            raise ValueError('websafeKey is not a %s key' % job.kind)
+    elif job.kind == 'Conference':
+        if not data.get('organizerUserId'):
+            raise ValueError("'organizerUserId' field required")
+        key = ndb.Key(Profile, data['organizerUserId'], Conference, import_id)
+    else:
+        if not record.get('websafeConferenceKey'):
+            raise ValueError("'websafeConferenceKey' field required")
+        key = ndb.Key(Session, import_id,
+                      parent=ndb.Key(urlsafe=record['websafeConferenceKey']))
+
+    if job.kind == 'Session' and (not key.parent() or
+                                  key.parent().kind() != 'Conference'):
+        raise ValueError('websafeConferenceKey is not a Conference key')
+
+    if job.kind == 'Conference':
+        if data.get('startDate'):
+            data['month'] = data['startDate'].month
+        if 'seatsAvailable' not in data and 'maxAttendees' in data:
+            data['seatsAvailable'] = data['maxAttendees']
+    else:
+        if data.get('speaker'):
+            data['speaker'] = ' '.join(data['speaker'].split())
+        data['typeOfSession'] = (data.get('typeOfSession') or
+                                 'NOT_SPECIFIED').upper()
+        if data['typeOfSession'] not in TypeOfSession.to_dict():
+            raise ValueError('Not a valid session type')
+    return KINDS[job.kind](key=key, **data)
+
+
+def _invalidate(job, entities):
+    """Drop the cached data of imported entities; safe to repeat."""
+    keys = [entity.key for entity in entities]
+    if job.kind == 'Conference':
+        querycache.bump()
+        for conf_k in keys:
+            confcache.invalidate(conf_k)
+    else:
+        conf_keys = set(key.parent() for key in keys)
+        # the featured speaker indexes are rebuilt from the sessions
+        ndb.delete_multi([SpeakerIndex.keyFor(conf_k) for conf_k in conf_keys])
+        for conf_k in conf_keys:
+            confcache.invalidate(conf_k)
+
+
+def _error(job, offset, e):
+    job.errors += 1
+    job.lastError = 'At byte %d: %s' % (offset, e)
+    logging.warning('Bulk import %d: %s', job.key.id(), job.lastError)
+
+
+def _withConference(job, records):
+    """Return the (offset, Session) records whose Conference exists."""
+    conf_keys = list(set(entity.key.parent() for offset, entity in records))
+    found = set(conf.key for conf in ndb.get_multi(conf_keys) if conf)
+    kept = []
+    for offset, entity in records:
+        if entity.key.parent() in found:
+            kept.append((offset, entity))
+        else:
+            _error(job, offset, 'No conference found with key: %s' %
+                   entity.key.parent().urlsafe())
+    return kept
+
+
+def _keepExisting(job, entities, existing):
+    """Keep the KEPT_FIELDS of the entities an import overwrites."""
+    for entity, old in zip(entities, existing):
+        if old:
+            for field in KEPT_FIELDS[job.kind]:
+                setattr(entity, field, getattr(old, field))
+
+
+def _enqueueSpeakerRemovals(job, entities, existing):
+    """
+    Take overwritten Sessions off the Speakers they no longer have. The
+    task is named after the step, as a retried batch reads the versions
+    the first attempt stored.
+    """
+    removed = [old for entity, old in zip(entities, existing)
+               if old and Speaker.keyFor(old.speaker) and
+               Speaker.keyFor(old.speaker) != Speaker.keyFor(entity.speaker)]
+    try:
+        speakers.enqueueChanges((), removed, name='bulk-speakers-%d-%d' %
+                                (job.key.id(), job.step))
+    except (taskqueue.TaskAlreadyExistsError, taskqueue.TombstonedTaskError):
+        pass
+
+
+@ndb.transactional()
+def _saveImportStep(job, entities):
+    """Save a job's step with the index tasks of its batch, at most once."""
+    job.put()
+    fulltext.enqueueIndex([entity.key for entity in entities])
+    if job.kind == 'Session':
+        speakers.enqueueChanges(entities)
+
+
+def _importBatch(job):
+    """Import the next IMPORT_BATCH records of the job's file."""
+    reader = blobstore.BlobReader(job.blobKey, buffer_size=READ_BUFFER,
+                                  position=job.offset)
+    records, count = [], 0
+    for offset, record in _readRecords(reader, job):
+        count += 1
+        try:
+            records.append((offset, _entity(job, offset, record)))
+        except Exception as e:
+            _error(job, offset, e)
+        if count == IMPORT_BATCH:
+            break
+    if job.kind == 'Session' and records:
+        records = _withConference(job, records)
+    entities = [entity for offset, entity in records]
+    if entities:
+        existing = ndb.get_multi([entity.key for entity in entities])
+        _keepExisting(job, entities, existing)
+        if job.kind == 'Session':
+            _enqueueSpeakerRemovals(job, entities, existing)
+        ndb.put_multi(entities)
+        _invalidate(job, entities)
+
+    job.records += len(entities)
+    job.offset = reader.tell()
+    job.step += 1
+    if count < IMPORT_BATCH:
+        job.status = DONE
+    _saveImportStep(job, entities)
+
+
+# - - - export - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+
+def _record(entity):
+    """Return the export record of an entity, a dict of its FIELDS."""
+    record = {'websafeKey': entity.key.urlsafe()}
+    if isinstance(entity, Session):
+        record['websafeConferenceKey'] = entity.key.parent().urlsafe()
+    for field in FIELDS[entity._get_kind()]:
+        if field not in record:
+            value = getattr(entity, field)
+            if isinstance(value, date):
+                value = value.isoformat()
+            record[field] = value
+    return record
+
+
+def _csvValue(value):
+    if value is None:
+        return ''
+    if isinstance(value, list):
+        value = LIST_SEPARATOR.join(value)
+    return unicode(value).encode('utf-8')
+
+
+def _exportBatch(job):
+    """Write the next BulkPart of the job's export."""
+    fields = FIELDS[job.kind]
+    out = cStringIO.StringIO()
+    writer = csv.writer(out) if job.format == 'csv' else None
+    if writer and not job.parts:
+        writer.writerow(fields)
+
+    cursor = Cursor(urlsafe=job.cursor) if job.cursor else None
+    more = True
+    while more and out.tell() < PART_BYTES:
+        entities, cursor, more = KINDS[job.kind].query().fetch_page(
+            EXPORT_BATCH, start_cursor=cursor)
+        for entity in entities:
+            record = _record(entity)
+            if writer:
+                writer.writerow([_csvValue(record[field]) for field in fields])
+            else:
+                out.write(json.dumps(record, sort_keys=True))
+                out.write('\n')
+        job.records += len(entities)
+        more = more and cursor is not None
+
+    job.cursor = cursor.urlsafe() if more else None
+    job.parts += 1
+    job.step += 1
+    if not more:
+        job.status = DONE
+    part = BulkPart(parent=job.key, id=job.parts, data=out.getvalue())
+    # the part and the job's progress are in one entity group
+    ndb.transaction(lambda: ndb.put_multi([part, job]))
+
+
+def exportPart(job_id, part):
+    """Return (content type, data) of a part of an export, None if missing."""
+    job_key = ndb.Key(BulkJob, job_id)
+    job, part = ndb.get_multi([job_key, ndb.Key(BulkPart, part,
+                                                parent=job_key)])
+    if not job or not part:
+        return None
+    return FORMATS[job.format], part.data
+
+
+def progress(job):
+    """Return the progress of a job as a dict."""
+    data = {
+        'job': job.key.id(),
+        'operation': job.operation,
+        'kind': job.kind,
+        'format': job.format,
+        'status': job.status,
+        'records': job.records,
+        'errors': job.errors,
+        'lastError': job.lastError,
+    }
+    if job.operation == 'import':
+        info = blobstore.BlobInfo.get(job.blobKey)
+        data['bytesRead'] = job.offset
+        data['bytesTotal'] = info.size if info else None
+    else:
+        data['parts'] = job.parts
+    return data
@@ -0,0 +1,102 @@
+#!/usr/bin/env python
+
+"""
+confcache.py -- versioned memcache of per-conference read payloads
+
+Entries are serialized ProtoRPC messages stored under the current
+version of a scope, here a conference. Bumping the version with
+invalidate() orphans every entry of that conference at once; orphans
+simply expire. Take the entryKey() before reading the datastore, so that
+a write racing with the read leaves the stale payload under the old
+version. VersionedCache is shared with querycache.py.
+
+"""
+
+import time
+
+from google.appengine.api import memcache
+from protorpc import protobuf
+
+ENTRY_TTL = 3600  # seconds
+
+
+class VersionedCache(object):
+    """Messages in memcache under versioned scopes, with hit counters."""
+
+    def __init__(self, prefix, ttl):
+        self.prefix = prefix
+        self.ttl = ttl
+        self.hitsKey = prefix + 'HITS'
+        self.missesKey = prefix + 'MISSES'
+
+    def _versionKey(self, scope):
+        return '%sVERSION_%s' % (self.prefix, scope)
+
+    def version(self, scope):
+        """Return the version of a scope, starting a new one if evicted."""
+        version = memcache.get(self._versionKey(scope))
+        if version is None:
+            # never restart from an old value, or stale entries would come back
+            memcache.add(self._versionKey(scope), int(time.time() * 1000))
+            version = memcache.get(self._versionKey(scope))
+        return version
+
+    def entryKey(self, scope, name):
+        """Return the key of a named entry under the scope's current version."""
+        return '%s%s_%s_%s' % (self.prefix, scope, self.version(scope), name)
+
+    def get(self, entry_key, message_type):
+        """Return the cached message, None on a miss."""
+        data = memcache.get(entry_key)
+        if data is None:
+            memcache.incr(self.missesKey, initial_value=0)
+            return None
+        memcache.incr(self.hitsKey, initial_value=0)
+        return protobuf.decode_message(message_type, data)
+
+    def set(self, entry_key, message):
+        """Cache a message under a key from entryKey()."""
+        memcache.set(entry_key, protobuf.encode_message(message),
+                     time=self.ttl)
+
+    def bump(self, scope):
+        """Drop every cached entry of a scope."""
+        # a missing version means nothing of the scope is cached either
+        memcache.incr(self._versionKey(scope))
+
+    def stats(self):
+        """Return the hit and miss counters and the hit rate."""
+        counters = memcache.get_multi([self.hitsKey, self.missesKey])
+        hits = counters.get(self.hitsKey, 0)
+        misses = counters.get(self.missesKey, 0)
+        return {'hits': hits, 'misses': misses,
+                'hit_rate': round(float(hits) / (hits + misses), 4)
+                            if hits + misses else None}
+
+
+_cache = VersionedCache('CONF_CACHE_', ENTRY_TTL)
+
+
+def entryKey(conf_key, name):
+    """Return the key of a named entry under the conference's current version."""
+    return _cache.entryKey(conf_key.urlsafe(), name)
+
+
+def get(entry_key, message_type):
+    """Return the cached message, None on a miss."""
+    return _cache.get(entry_key, message_type)
+
+
+def set(entry_key, message):
+    """Cache a message under a key from entryKey()."""
+    _cache.set(entry_key, message)
+
+
+def invalidate(conf_key):
+    """Drop every cached entry of a conference."""
+    _cache.bump(conf_key.urlsafe())
+
+
+def stats():
+    """Return the hit and miss counters and the hit rate."""
+    return _cache.stats()
@@ -14,18 +14,25 @@ __author__ = 'wesc+api@google.com (Wesley Chun)'
 
 
 from datetime import datetime
+import logging
 
 import endpoints
 from protorpc import messages
 from protorpc import message_types
+from protorpc import protobuf
 from protorpc import remote
 
 from google.appengine.api import memcache
+from google.appengine.api import datastore_errors
+from google.appengine.api import search
 from google.appengine.api import taskqueue
+from google.appengine.datastore.datastore_query import Cursor
 from google.appengine.ext import ndb
 
 from models import ConflictException
 from models import Profile
+from models import Registration
+from models import AttendeeForms
 from models import ProfileMiniForm
 from models import ProfileForm
 from models import StringMessage
@@ -36,14 +43,26 @@ from models import ConferenceForms
 from models import ConferenceQueryForm
 from models import ConferenceQueryForms
 from models import TeeShirtSize
+from models import TypeOfSession
 from models import Session
 from models import SessionForm
 from models import SessionForms
 from models import SessionQueryForm
 from models import SessionQueryForms
-from models import TypeOfSession
+from models import SessionSlotForms
+from models import ScheduleDayForm
+from models import ScheduleForm
+from models import ScheduleItemForm
+from models import ConferenceStatsForm
 from models import FeatureSpeaker
+from models import StatCountForm
+from models import Speaker
+from models import SpeakerForm
+from models import SpeakerForms
+from models import SpeakerIndex
 from models import SpeakerSessionQueryForm
+from models import SearchForm
+from models import View
 
 from settings import WEB_CLIENT_ID
 from settings import ANDROID_CLIENT_ID
@@ -52,13 +71,30 @@ from settings import ANDROID_AUDIENCE
 
 from utils import getUserId
 
+import analytics
+import announcement
+import confcache
+import fulltext
+import instrumentation
+import leaderboard
+import mappers
+import notifications
+import planner
+import querycache
+import schedule
+import seats
+import speakers
+
 EMAIL_SCOPE = endpoints.EMAIL_SCOPE
 API_EXPLORER_CLIENT_ID = endpoints.API_EXPLORER_CLIENT_ID
-MEMCACHE_ANNOUNCEMENTS_KEY = "RECENT_ANNOUNCEMENTS"
 SPEAKER_ANNOUNCEMENTS_KEY = "FEATURED_SPEAKER_ FOR_"
-ANNOUNCEMENT_TPL = ('Last chance to attend! The following conferences '
-                    'are nearly sold out: %s')
+MEMCACHE_ORGANIZER_PREFIX = "ORGANIZER_NAME_"
+ORGANIZER_NAME_TTL = 3600
 ANNOUNCEMENT_SPK = ('Hear %s speak at %s. Featured during these sessions: %s.')
+DEFAULT_PAGE_SIZE = 20
+MAX_PAGE_SIZE = 100
+MAX_SESSIONS_PER_BATCH = 500
+SESSION_PUT_CHUNK = 100
 # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
 
 DEFAULTS = {
@@ -94,6 +130,19 @@ CONF_GET_REQUEST = endpoints.ResourceContainer(
     websafeConferenceKey=messages.StringField(1),
 )
 
+SESS_GET_REQUEST = endpoints.ResourceContainer(
+    message_types.VoidMessage,
+    websafeConferenceKey=messages.StringField(1),
+    view=messages.EnumField(View, 2, default='FULL'),
+)
+
+CONF_PAGE_GET_REQUEST = endpoints.ResourceContainer(
+    message_types.VoidMessage,
+    websafeConferenceKey=messages.StringField(1),
+    pageSize=messages.IntegerField(2),
+    pageToken=messages.StringField(3),
+)
+
 CONF_POST_REQUEST = endpoints.ResourceContainer(
     ConferenceForm,
     websafeConferenceKey=messages.StringField(1),
@@ -119,6 +168,12 @@ SINGLE_POST_REQUEST = endpoints.ResourceContainer(
     websafeConferenceKey=messages.StringField(1),
 )
 
+PAGE_GET_REQUEST = endpoints.ResourceContainer(
+    message_types.VoidMessage,
+    pageSize=messages.IntegerField(1),
+    pageToken=messages.StringField(2),
+)
+
 WISHLIST_POST_REQUEST = endpoints.ResourceContainer(
     message_types.VoidMessage,
     websafeSessionsKey=messages.StringField(1),
@@ -134,25 +189,55 @@ WISHLIST_POST_REQUEST = endpoints.ResourceContainer(
 class ConferenceApi(remote.Service):
     """Conference API v0.1"""
 
+    # request-scoped caches, see _getCurrentUser
+    _currentUser = None
+    _profileFuture = None
+
 # - - - Conference objects - - - - - - - - - - - - - - - - -
 
     def _copyConferenceToForm(self, conf, displayName):
         """Copy relevant fields from Conference to ConferenceForm."""
-        cf = ConferenceForm()
-        for field in cf.all_fields():
-            if hasattr(conf, field.name):
-                # convert Date to date string; just copy others
-                if field.name.endswith('Date'):
-                    setattr(cf, field.name, str(getattr(conf, field.name)))
-                else:
-                    setattr(cf, field.name, getattr(conf, field.name))
-            elif field.name == "websafeKey":
-                setattr(cf, field.name, conf.key.urlsafe())
+        cf = mappers.CONFERENCE.copy(conf)
         if displayName:
-            setattr(cf, 'organizerDisplayName', displayName)
-        cf.check_initialized()
+            cf.organizerDisplayName = displayName
         return cf
 
+    def _organizerNames(self, user_ids):
+        """
+        Resolve organizer displayNames through the shared organizer-name
+        cache, fetching the missing, deduplicated Profiles in one batch.
+        """
+        user_ids = list(set(user_ids))
+        names = memcache.get_multi(user_ids,
+                                   key_prefix=MEMCACHE_ORGANIZER_PREFIX)
+        missing = [uid for uid in user_ids if uid not in names]
+        profiles = ndb.get_multi([ndb.Key(Profile, uid) for uid in missing])
+
+        fetched = dict((prof.key.id(), prof.displayName)
+                       for prof in profiles if prof)
+        if fetched:
+            names.update(fetched)
+            memcache.set_multi(fetched, key_prefix=MEMCACHE_ORGANIZER_PREFIX,
+                               time=ORGANIZER_NAME_TTL)
+        return names
+
+    def _setOrganizerNames(self, forms):
+        """
+        Fill in the organizerDisplayName of ConferenceForms of Conferences
+        stored before it was kept on the Conference.
+        """
+        missing = [cf for cf in forms if cf.organizerDisplayName is None]
+        if missing:
+            names = self._organizerNames(
+                cf.organizerUserId for cf in missing)
+            for cf in missing:
+                cf.organizerDisplayName = names.get(cf.organizerUserId)
+        return forms
+
+    def _copyConferencesToForms(self, confs):
+        """Copy Conferences to ConferenceForms."""
+        return self._setOrganizerNames(mappers.CONFERENCE.copyMany(confs))
+
     def _createConferenceObject(self, request):
         """Create or update Conference object, returning ConferenceForm/request."""
         # preload necessary data items
@@ -167,7 +252,6 @@ class ConferenceApi(remote.Service):
         # copy ConferenceForm/ProtoRPC Message into dict
         data = {field.name: getattr(request, field.name) for field in request.all_fields()}
         del data['websafeKey']
-        del data['organizerDisplayName']
 
         # add default values for those missing (both data model & outbound Message)
         for df in DEFAULTS:
@@ -194,14 +278,21 @@ class ConferenceApi(remote.Service):
         c_key = ndb.Key(Conference, c_id, parent=p_key)
         data['key'] = c_key
         data['organizerUserId'] = request.organizerUserId = user_id
+        # kept on the Conference, see _doProfile for renames
+        data['organizerDisplayName'] = request.organizerDisplayName = \
+            self._getProfileFromUser().displayName
+
+        # split the seats into shards, stored before the Conference
+        # so that a Conference never points at missing shards
+        shards = seats.makeSeatShards(c_key, data['seatsAvailable'])
+        ndb.put_multi(shards)
+        data['seatShards'] = len(shards)
 
         # create Conference, send email to organizer confirming
         # creation of Conference & return (modified) ConferenceForm
         Conference(**data).put()
-        taskqueue.add(params={'email': user.email(),
-            'conferenceInfo': repr(request)},
-            url='/tasks/send_confirmation_email'
-        )
+        fulltext.enqueueIndex([c_key])
+        notifications.enqueueConfirmation(c_key)
         return request
 
 
@@ -227,9 +318,22 @@ class ConferenceApi(remote.Service):
             raise endpoints.ForbiddenException(
                 'Only the owner can update the conference.')
 
+        # seats are tracked by the seat shards; a new maxAttendees
+        # adds or removes the difference
+        if request.maxAttendees not in (None, conf.maxAttendees):
+            delta = request.maxAttendees - (conf.maxAttendees or 0)
+            if conf.seatShards:
+                taskqueue.add(url='/tasks/adjust_seats',
+                    params={'key': conf.key.urlsafe(), 'delta': delta},
+                    transactional=True)
+            else:
+                conf.seatsAvailable = max(0, (conf.seatsAvailable or 0) + delta)
+
         # Not getting all the fields, so don't create a new object; just
         # copy relevant fields from ConferenceForm to Conference object
         for field in request.all_fields():
+            if field.name in ('seatsAvailable', 'organizerDisplayName'):
+                continue
             data = getattr(request, field.name)
             # only copy fields where we get data
             if data not in (None, []):
@@ -241,15 +345,17 @@ class ConferenceApi(remote.Service):
                 # write to Conference object
                 setattr(conf, field.name, data)
         conf.put()
-        prof = ndb.Key(Profile, user_id).get()
-        return self._copyConferenceToForm(conf, getattr(prof, 'displayName'))
+        fulltext.enqueueIndex([conf.key])
+        return self._copyConferencesToForms([conf])[0]
 
 
     @endpoints.method(ConferenceForm, ConferenceForm, path='conference',
             http_method='POST', name='createConference')
     def createConference(self, request):
         """Create new conference."""
-        return self._createConferenceObject(request)
+        cf = self._createConferenceObject(request)
+        querycache.bump()
+        return cf
 
 
     @endpoints.method(CONF_POST_REQUEST, ConferenceForm,
@@ -257,7 +363,12 @@ class ConferenceApi(remote.Service):
             http_method='PUT', name='updateConference')
     def updateConference(self, request):
         """Update conference w/provided fields & return w/updated info."""
-        return self._updateConferenceObject(request)
+        # after the transaction, so no read re-caches the old version
+        cf = self._updateConferenceObject(request)
+        confcache.invalidate(ndb.Key(urlsafe=cf.websafeKey))
+        querycache.bump()
+        announcement.refresh(cf.websafeKey, cf.name, cf.seatsAvailable)
+        return cf
 
 
     @endpoints.method(CONF_GET_REQUEST, ConferenceForm,
@@ -265,14 +376,19 @@ class ConferenceApi(remote.Service):
             http_method='GET', name='getConference')
     def getConference(self, request):
         """Return requested conference (by websafeConferenceKey)."""
-        # get Conference object from request; bail if not found
-        conf = ndb.Key(urlsafe=request.websafeConferenceKey).get()
-        if not conf:
-            raise endpoints.NotFoundException(
-                'No conference found with key: %s' % request.websafeConferenceKey)
-        prof = conf.key.parent().get()
+        conf_k = ndb.Key(urlsafe=request.websafeConferenceKey)
+        cache_key = confcache.entryKey(conf_k, 'conference')
+        cf = confcache.get(cache_key, ConferenceForm)
+        if cf is None:
+            # get Conference object from request; bail if not found
+            conf = conf_k.get()
+            if not conf:
+                raise endpoints.NotFoundException(
+                    'No conference found with key: %s' % request.websafeConferenceKey)
+            cf = self._copyConferenceToForm(conf, None)
+            confcache.set(cache_key, cf)
         # return ConferenceForm
-        return self._copyConferenceToForm(conf, getattr(prof, 'displayName'))
+        return self._setOrganizerNames([cf])[0]
 
 
     @endpoints.method(message_types.VoidMessage, ConferenceForms,
@@ -287,12 +403,9 @@ class ConferenceApi(remote.Service):
         user_id = getUserId(user)
 
         # create ancestor query for all key matches for this user
-        confs = Conference.query(ancestor=ndb.Key(Profile, user_id))
-        prof = ndb.Key(Profile, user_id).get()
+        confs = Conference.query(ancestor=ndb.Key(Profile, user_id)).fetch()
         # return set of ConferenceForm objects per Conference
-        return ConferenceForms(
-            items=[self._copyConferenceToForm(conf, getattr(prof, 'displayName')) for conf in confs]
-        )
+        return ConferenceForms(items=self._copyConferencesToForms(confs))
 
 
     def _getQuery(self, request):
@@ -308,13 +421,96 @@ class ConferenceApi(remote.Service):
             q = q.order(ndb.GenericProperty(inequality_filter))
             q = q.order(Conference.name)
         for filtr in filters:
-            if filtr["field"] in ["month", "maxAttendees"]:
+            if filtr["field"] in querycache.INTEGER_FIELDS:
                 filtr["value"] = int(filtr["value"])
             formatted_query = ndb.query.FilterNode(filtr["field"], filtr["operator"], filtr["value"])
             q = q.filter(formatted_query)
         return q
 
 
+    def _pageSize(self, request):
+        """Return the checked pageSize of a request."""
+        page_size = request.pageSize or DEFAULT_PAGE_SIZE
+        if page_size < 1 or page_size > MAX_PAGE_SIZE:
+            raise endpoints.BadRequestException(
+                'pageSize must be between 1 and %d' % MAX_PAGE_SIZE)
+        return page_size
+
+    def _pageCursor(self, request):
+        """Return the Cursor of the pageToken of a request, if any."""
+        try:
+            return Cursor(urlsafe=request.pageToken) if request.pageToken \
+                else None
+        except Exception:
+            raise endpoints.BadRequestException('Invalid pageToken.')
+
+    def _fetchPage(self, query, request, **options):
+        """
+        Fetch one page of query results using the pageSize/pageToken of
+        the request, returning (results, nextPageToken). Extra options
+        (e.g. keys_only) are passed on to fetch_page.
+        """
+        page_size = self._pageSize(request)
+        cursor = self._pageCursor(request)
+        results, next_cursor, more = query.fetch_page(page_size,
+                                                      start_cursor=cursor,
+                                                      **options)
+        if more and next_cursor:
+            return results, next_cursor.urlsafe()
+        return results, None
+
+    def _fetchFilteredPage(self, query, predicates, request):
+        """
+        Like _fetchPage, but only returning the results that pass the
+        in-memory predicates of planner.plan. A page may come back short
+        when the scan limit is reached; nextPageToken continues the scan.
+        """
+        results, next_cursor = planner.fetchPage(
+            query, predicates, self._pageSize(request),
+            self._pageCursor(request))
+        return results, next_cursor.urlsafe() if next_cursor else None
+
+    @staticmethod
+    def _pinnedValues(filters):
+        """
+        Return the values of the properties pinned by equality filters of
+        a query (property -> value), or None when the query is an OR of
+        several queries, which pin different values.
+        """
+        if filters is None:
+            return {}
+        if isinstance(filters, ndb.query.FilterNode):
+            filters = [filters]
+        elif not isinstance(filters, ndb.query.ConjunctionNode):
+            return None
+        pinned = {}
+        for node in filters:
+            name, op, value = node.__getnewargs__()
+            if op == '=':
+                pinned[name] = value
+        return pinned
+
+    def _fetchSummaryPage(self, query, request, mapper):
+        """
+        Fetch one page of query as summary forms, returning (forms,
+        nextPageToken). The summary properties are read with a projection
+        query, leaving out those pinned by equality filters (which can't
+        be projected); queries with no projection index get full entities.
+        """
+        pinned = self._pinnedValues(query.filters)
+        if pinned is not None:
+            projection = [name for name in mapper.properties
+                          if name not in pinned]
+            try:
+                entities, next_token = self._fetchPage(query, request,
+                                                       projection=projection)
+                return mapper.withValues(pinned).copyMany(entities), next_token
+            except datastore_errors.NeedIndexError:
+                logging.warning('No summary index for %s', query)
+        entities, next_token = self._fetchPage(query, request)
+        return mapper.copyMany(entities), next_token
+
+
     def _formatFilters(self, filters):
         """Parse, check validity and format user supplied filters."""
         formatted_filters = []
@@ -348,54 +544,117 @@ class ConferenceApi(remote.Service):
             http_method='POST',
             name='queryConferences')
     def queryConferences(self, request):
-        """Query for conferences."""
-        conferences = self._getQuery(request)
-
-        # need to fetch organiser displayName from profiles
-        # get all keys and use get_multi for speed
-        organisers = [(ndb.Key(Profile, conf.organizerUserId)) for conf in conferences]
-        profiles = ndb.get_multi(organisers)
-
-        # put display names in a dict for easier fetching
-        names = {}
-        for profile in profiles:
-            names[profile.key.id()] = profile.displayName
+        """
+        Query for conferences, one page at a time; the SUMMARY view only
+        returns the fields of the conference list. Pages are cached by
+        their normalized filters until a conference changes.
+        """
+        filters = self._formatFilters(request.filters)[1]
+        cache_key = querycache.entryKey(
+            filters, request.pageSize or DEFAULT_PAGE_SIZE, request.pageToken,
+            request.view)
+        forms = querycache.get(cache_key, ConferenceForms)
+        if forms is not None:
+            return forms
+
+        if request.view == View.SUMMARY:
+            summaries, next_token = self._fetchSummaryPage(
+                self._getQuery(request), request, mappers.CONFERENCE_SUMMARY)
+            forms = ConferenceForms(
+                    summaries=self._setOrganizerNames(summaries),
+                    nextPageToken=next_token
+            )
+        else:
+            conferences, next_token = self._fetchPage(self._getQuery(request),
+                                                      request)
+            # return individual ConferenceForm object per Conference
+            forms = ConferenceForms(
+                    items=self._copyConferencesToForms(conferences),
+                    nextPageToken=next_token
+            )
+        querycache.set(cache_key, forms)
+        return forms
 
-        # return individual ConferenceForm object per Conference
+    def _search(self, index_name, query_string, request):
+        """
+        Run a full-text search, returning (entities, nextPageToken) with
+        the entities best match first.
+        """
+        try:
+            keys, next_token = fulltext.searchKeys(
+                index_name, query_string, self._pageSize(request),
+                request.pageToken)
+        except (search.QueryError, ValueError):
+            raise endpoints.BadRequestException('Invalid query or pageToken.')
+        # documents of just deleted entities may still match
+        entities = [entity for entity in ndb.get_multi(keys) if entity]
+        return entities, next_token
+
+    @endpoints.method(SearchForm, ConferenceForms,
+            path='searchConferences',
+            http_method='POST',
+            name='searchConferences')
+    def searchConferences(self, request):
+        """
+        Full-text search of conference names, descriptions, topics and
+        cities, one page at a time.
+        """
+        conferences, next_token = self._search(
+            fulltext.CONFERENCE_INDEX, request.query, request)
         return ConferenceForms(
-                items=[self._copyConferenceToForm(conf, names[conf.organizerUserId]) for conf in \
-                conferences]
+                items=self._copyConferencesToForms(conferences),
+                nextPageToken=next_token
         )
 
 
 # - - - Profile objects - - - - - - - - - - - - - - - - - - -
 
-    def _copyProfileToForm(self, prof):
-        """Copy relevant fields from Profile to ProfileForm."""
-        # copy relevant fields from Profile to ProfileForm
-        pf = ProfileForm()
-        for field in pf.all_fields():
-            if hasattr(prof, field.name):
-                # convert t-shirt string to Enum; just copy others
-                if field.name == 'teeShirtSize':
-                    setattr(pf, field.name, getattr(TeeShirtSize, getattr(prof, field.name)))
-                else:
-                    setattr(pf, field.name, getattr(prof, field.name))
-        pf.check_initialized()
+    def _copyProfileToForm(self, prof, conf_keys=None):
+        """
+        Copy relevant fields from Profile to ProfileForm; conf_keys are
+        the keys of the conferences attended, if already fetched.
+        """
+        pf = mappers.PROFILE.copy(prof)
+        if conf_keys is None:
+            conf_keys = Registration.conferenceKeys(prof.key)
+        pf.conferenceKeysToAttend = [conf_key.urlsafe() for conf_key in conf_keys]
+        pf.wishlist = [s_key.urlsafe() for s_key in prof.wishlistKeys]
         return pf
 
 
-    def _getProfileFromUser(self):
+    def _getCurrentUser(self):
+        """
+        Return the authed user and the key of their Profile. Services are
+        instantiated per request, so this is worked out once per request.
+        """
+        if self._currentUser is None:
+            # make sure user is authed
+            user = endpoints.get_current_user()
+            if not user:
+                raise endpoints.UnauthorizedException('Authorization required')
+            self._currentUser = (user, ndb.Key(Profile, getUserId(user)))
+        return self._currentUser
+
+
+    def _getProfileFromUserAsync(self):
+        """
+        Return a Future of the user Profile, shared by all callers within
+        the request. Inside a transaction the Profile is always re-read.
+        """
+        if ndb.in_transaction():
+            return self._loadProfileAsync()
+        if self._profileFuture is None:
+            self._profileFuture = self._loadProfileAsync()
+        return self._profileFuture
+
+
+    @ndb.tasklet
+    def _loadProfileAsync(self):
         """Return user Profile from datastore, creating new one if non-existent."""
-        # make sure user is authed
-        user = endpoints.get_current_user()
-        if not user:
-            raise endpoints.UnauthorizedException('Authorization required')
+        user, p_key = self._getCurrentUser()
 
         # get Profile from datastore
-        user_id = getUserId(user)
-        p_key = ndb.Key(Profile, user_id)
-        profile = p_key.get()
+        profile = yield p_key.get_async()
         # create new Profile if not there
         if not profile:
             profile = Profile(
@@ -404,16 +663,47 @@ class ConferenceApi(remote.Service):
                 mainEmail= user.email(),
                 teeShirtSize = str(TeeShirtSize.NOT_SPECIFIED),
             )
-            profile.put()
+            yield profile.put_async()
+        # move registrations of profiles not migrated yet
+        elif profile.conferenceKeysToAttend:
+            Registration.migrateProfile(p_key)
+            profile.conferenceKeysToAttend = []
+        # and wishlists still stored as websafe keys
+        if profile.wishlist:
+            profile.wishlistKeys = Profile.migrateWishlist(p_key)
+            profile.wishlist = []
 
-        return profile      # return Profile
+        raise ndb.Return(profile)      # return Profile
+
+
+    def _getProfileFromUser(self):
+        """Return user Profile, see _getProfileFromUserAsync."""
+        return self._getProfileFromUserAsync().get_result()
+
+
+    @ndb.tasklet
+    def _getProfileAndAttendingAsync(self):
+        """
+        Return the user Profile and the keys of the conferences it
+        attends, reading both at the same time.
+        """
+        p_key = self._getCurrentUser()[1]
+        profile, conf_keys = yield (p_key.get_async(),
+                                    Registration.conferenceKeysAsync(p_key))
+        if (not profile or profile.conferenceKeysToAttend or
+                profile.wishlist):
+            # new profile, or registrations or wishlist not migrated yet
+            profile = yield self._getProfileFromUserAsync()
+            conf_keys = yield Registration.conferenceKeysAsync(p_key)
+        raise ndb.Return((profile, conf_keys))
 
 
     def _doProfile(self, save_request=None):
         """Get user Profile and return to user, possibly updating it first."""
-        prof = self._getProfileFromUser()
+        prof, conf_keys = self._getProfileAndAttendingAsync().get_result()
 
         # if saveProfile(), process user-modifyable fields
+        changed = []
         if save_request:
             for field in ('displayName', 'teeShirtSize'):
                 if hasattr(save_request, field):
@@ -424,26 +714,55 @@ class ConferenceApi(remote.Service):
                         #    setattr(prof, field, str(val).upper())
                         # else:
                         #    setattr(prof, field, val)
-                        prof.put()
+                        changed.append(field)
+        if changed:
+            prof.put()
+            if 'displayName' in changed:
+                memcache.delete(MEMCACHE_ORGANIZER_PREFIX + prof.key.id())
+                # copy the new name to the organizer's conferences
+                taskqueue.add(url='/tasks/update_organizer_name',
+                              params={'key': prof.key.urlsafe()})
 
         # return ProfileForm
-        return self._copyProfileToForm(prof)
-
-    def _getWishlist(self):
-        """Get all wishlisted sessions for a user."""
-        # get user Profile
-        prof = self._getProfileFromUser()
-
-        s_keys = [ndb.Key(urlsafe=wssk) for wssk in prof.wishlist]
-        sessions = ndb.get_multi(s_keys)
+        return self._copyProfileToForm(prof, conf_keys)
 
-        if not sessions:
-             return SessionForm()
-        else:
-            # return SessionForms from user wishlist
-            return SessionForms(
-                sessions=[self._copySessionToForm(session) for session in sessions]
-            )
+    @ndb.tasklet
+    def _getWishlistAsync(self, offset, page_size):
+        """
+        Get one page of the wishlisted sessions of a user, grouped by
+        conference, returning (sessions, more). Deleted sessions are
+        skipped.
+        """
+        # get user Profile; the sessions to get depend on it
+        prof = yield self._getProfileFromUserAsync()
+
+        # one bounded batch, through the context cache and memcache
+        s_keys = prof.wishlistKeys[offset:offset + page_size]
+        sessions = yield ndb.get_multi_async(s_keys)
+        order = {}
+        for s_key in s_keys:
+            order.setdefault(s_key.parent(), len(order))
+        sessions = sorted((session for session in sessions if session),
+                          key=lambda session: order[session.key.parent()])
+        raise ndb.Return(sessions,
+                         offset + page_size < len(prof.wishlistKeys))
+
+    def _getWishlist(self, request):
+        """Get one page of the wishlisted sessions for a user."""
+        page_size = self._pageSize(request)
+        try:
+            offset = int(request.pageToken or 0)
+        except ValueError:
+            offset = -1
+        if offset < 0:
+            raise endpoints.BadRequestException('Invalid pageToken.')
+        sessions, more = self._getWishlistAsync(offset, page_size).get_result()
+
+        # return SessionForms from user wishlist
+        return SessionForms(
+            sessions=mappers.SESSION.copyMany(sessions),
+            nextPageToken=str(offset + page_size) if more else None
+        )
 
     @endpoints.method(message_types.VoidMessage, ProfileForm,
             path='profile', http_method='GET', name='getProfile')
@@ -464,59 +783,43 @@ class ConferenceApi(remote.Service):
     @staticmethod
     def _cacheAnnouncement():
         """Create Announcement & assign to memcache; used by
-        memcache cron job & putAnnouncement().
-        """
-        confs = Conference.query(ndb.AND(
-            Conference.seatsAvailable <= 5,
-            Conference.seatsAvailable > 0)
-        ).fetch(projection=[Conference.name])
-
-        if confs:
-            # If there are almost sold out conferences,
-            # format announcement and set it in memcache
-            announcement = ANNOUNCEMENT_TPL % (
-                ', '.join(conf.name for conf in confs))
-            memcache.set(MEMCACHE_ANNOUNCEMENTS_KEY, announcement)
-        else:
-            # If there are no sold out conferences,
-            # delete the memcache announcements entry
-            announcement = ""
-            memcache.delete(MEMCACHE_ANNOUNCEMENTS_KEY)
+        memcache cron job & putAnnouncement(). The announcement is kept
+        up to date by the seat fold; this reconciles it with a query.
+        """
+        return announcement.rebuild()
 
-        return announcement
+    @staticmethod
+    def _featuredSpeaker(conf_k):
+        """
+        Return the featured speaker of a conference, the speaker in the
+        most sessions according to its SpeakerIndex; "" if there is none.
+        """
+        conf, index = ndb.get_multi([conf_k, SpeakerIndex.keyFor(conf_k)])
+        if not conf:
+            return ""
+        # conferences from before the index get theirs built on the fly
+        featured = SpeakerIndex.current(index, conf_k).featured()
+        if not featured:
+            return ""
+        return {
+            "name": featured[0].title(),
+            "conf_name": conf.name.title(),
+            "sessions": featured[1]
+        }
 
     @staticmethod
     def _cacheFeaturedSpeaker(self):
         """
         Create memcache for a featured Speaker of a conference.
         """
-        # Get the conference that the speaker is speaking
-        # at from the websafeKey provided in the request
-        conf_k = ndb.Key(urlsafe=self.request.get('key'))
-        conf = conf_k.get()
-        # The speaker that was just added
-        addedSpeaker = self.request.get('speaker')
-        # Find the speaker in the most sessions giving a Confenence
-        # and return (name, sessionsCount)
-        featuredSpeaker = Session.countspeakers(conf_k)
-        speakerName = featuredSpeaker[0]
-        sessionsSpeakersIn = featuredSpeaker[1]
-        speakerMemKey = SPEAKER_ANNOUNCEMENTS_KEY + self.request.get('key')
-        # Query that gets the name of the sessions the features speaker
-        sessionsInfo = [session.name for session in \
-            Session.query(ancestor=conf_k, projection=[Session.name]).\
-            filter(Session.speaker == speakerName)]
-        # Turn array into string then remove []
-        if sessionsSpeakersIn > 1 and speakerName == addedSpeaker:
-            speaker = {
-                "name": speakerName.title(),
-                "conf_name": conf.name.title(),
-                "sessions": sessionsInfo
-            }
-            memcache.add(key=speakerMemKey, value=speaker, time=600)
+        # Get the conference from the websafeKey provided in the request
+        wsck = self.request.get('key')
+        speaker = ConferenceApi._featuredSpeaker(ndb.Key(urlsafe=wsck))
+        speakerMemKey = SPEAKER_ANNOUNCEMENTS_KEY + wsck
+        if speaker:
+            memcache.set(speakerMemKey, speaker)
         else:
             # If no feature speaker
-            speaker = ""
             memcache.delete(speakerMemKey)
         return speaker
 
@@ -525,21 +828,26 @@ class ConferenceApi(remote.Service):
             http_method='GET', name='getAnnouncement')
     def getAnnouncement(self, request):
         """Return Announcement from memcache."""
-        return StringMessage(data=memcache.get(MEMCACHE_ANNOUNCEMENTS_KEY) or "")
+        return StringMessage(data=announcement.current())
 
 
 # - - - Registration - - - - - - - - - - - - - - - - - - - -
 
-    @ndb.transactional(xg=True)
     def _conferenceRegistration(self, request, reg=True):
         """Register or unregister user for selected conference."""
         retval = None
-        prof = self._getProfileFromUser() # get user Profile
+        # read the profile, the conference and the registration at once
+        p_key = self._getCurrentUser()[1]
+        wsck = request.websafeConferenceKey
+        conf_k = ndb.Key(urlsafe=wsck)
+        prof = self._getProfileFromUserAsync() # get user Profile
+        conf, registered = ndb.get_multi_async(
+            [conf_k, Registration.keyFor(p_key, conf_k)])
+        prof = prof.get_result()
 
         # check if conf exists given websafeConfKey
         # get conference; check that it exists
-        wsck = request.websafeConferenceKey
-        conf = ndb.Key(urlsafe=wsck).get()
+        conf = conf.get_result()
         if not conf:
             raise endpoints.NotFoundException(
                 'No conference found with key: %s' % wsck)
@@ -547,35 +855,19 @@ class ConferenceApi(remote.Service):
         # register
         if reg:
             # check if user already registered otherwise add
-            if wsck in prof.conferenceKeysToAttend:
+            if registered.get_result():
                 raise ConflictException(
                     "You have already registered for this conference")
 
-            # check if seats avail
-            if conf.seatsAvailable <= 0:
-                raise ConflictException(
-                    "There are no seats available.")
-
-            # register user, take away one seat
-            prof.conferenceKeysToAttend.append(wsck)
-            conf.seatsAvailable -= 1
-            retval = True
+            # register user, take away one seat from one of the
+            # seat shards; raises ConflictException when sold out
+            retval = seats.reserveSeat(conf, prof.key)
 
         # unregister
         else:
-            # check if user already registered
-            if wsck in prof.conferenceKeysToAttend:
+            # unregister user if registered, add back one seat
+            retval = seats.releaseSeat(conf, prof.key)
 
-                # unregister user, add back one seat
-                prof.conferenceKeysToAttend.remove(wsck)
-                conf.seatsAvailable += 1
-                retval = True
-            else:
-                retval = False
-
-        # write things back to the datastore & return
-        prof.put()
-        conf.put()
         return BooleanMessage(data=retval)
 
 
@@ -584,22 +876,99 @@ class ConferenceApi(remote.Service):
             http_method='GET', name='getConferencesToAttend')
     def getConferencesToAttend(self, request):
         """Get list of conferences that user has registered for."""
-        prof = self._getProfileFromUser() # get user Profile
-        conf_keys = [ndb.Key(urlsafe=wsck) for wsck in prof.conferenceKeysToAttend]
-        conferences = ndb.get_multi(conf_keys)
+        # get user Profile and the registrations together
+        prof, conf_keys = self._getProfileAndAttendingAsync().get_result()
+        conferences = [conf for conf in ndb.get_multi(conf_keys) if conf]
+
+        # return set of ConferenceForm objects per Conference
+        return ConferenceForms(items=self._copyConferencesToForms(conferences))
 
-        # get organizers
-        organisers = [ndb.Key(Profile, conf.organizerUserId) for conf in conferences]
-        profiles = ndb.get_multi(organisers)
 
-        # put display names in a dict for easier fetching
-        names = {}
-        for profile in profiles:
-            names[profile.key.id()] = profile.displayName
+    @endpoints.method(CONF_PAGE_GET_REQUEST, AttendeeForms,
+            path='conference/{websafeConferenceKey}/attendees',
+            http_method='GET', name='getConferenceAttendees')
+    def getConferenceAttendees(self, request):
+        """Return attendees of a conference; organizer only."""
+        user_id = self._getCurrentUser()[1].id()
 
-        # return set of ConferenceForm objects per Conference
-        return ConferenceForms(items=[self._copyConferenceToForm(conf, names[conf.organizerUserId])\
-         for conf in conferences]
+        conf_k = ndb.Key(urlsafe=request.websafeConferenceKey)
+        conf = conf_k.get()
+        if not conf:
+            raise endpoints.NotFoundException(
+                'No conference found with key: %s' % request.websafeConferenceKey)
+        if user_id != conf.organizerUserId:
+            raise endpoints.ForbiddenException(
+                'Only the owner can see the attendees.')
+
+        reg_keys, next_token = self._fetchPage(
+            Registration.attendeesQuery(conf_k), request, keys_only=True)
+        profiles = ndb.get_multi([reg_key.parent() for reg_key in reg_keys])
+        return AttendeeForms(
+            displayNames=[prof.displayName for prof in profiles if prof],
+            nextPageToken=next_token)
+
+
+    @endpoints.method(CONF_GET_REQUEST, ConferenceStatsForm,
+            path='conference/{websafeConferenceKey}/stats',
+            http_method='GET', name='getConferenceStats')
+    def getConferenceStats(self, request):
+        """
+        Return the statistics of a conference to its organizer: fill
+        rate, registrations per hour and per day, and sessions and
+        wishlists per session type and per day, from the rollups.
+        """
+        user_id = self._getCurrentUser()[1].id()
+
+        # the conference and all of its rollups in one batch
+        conf_k = ndb.Key(urlsafe=request.websafeConferenceKey)
+        rollup_keys = analytics.rollupKeys(conf_k)
+        entities = ndb.get_multi([conf_k] + rollup_keys)
+        conf, rollups = entities[0], entities[1:]
+        if not conf:
+            raise endpoints.NotFoundException(
+                'No conference found with key: %s' % request.websafeConferenceKey)
+        if user_id != conf.organizerUserId:
+            raise endpoints.ForbiddenException(
+                'Only the owner can see the statistics.')
+
+        counts = dict(zip([key.id() for key in rollup_keys],
+                          [(rollup.counts if rollup else {})
+                           for rollup in rollups]))
+        totals = counts.pop('total')
+
+        def countForms(items):
+            return [StatCountForm(label=label, count=count)
+                    for label, count in items]
+
+        def series(period):
+            # oldest first, as rollupKeys lists them
+            return countForms(
+                (key.id().split(':', 1)[1],
+                 counts[key.id()].get('registrations', 0))
+                for key in rollup_keys if key.id().startswith(period + ':'))
+
+        fill_rate = None
+        if conf.maxAttendees:
+            fill_rate = round(1.0 - float(conf.seatsAvailable or 0) /
+                              conf.maxAttendees, 4)
+        return ConferenceStatsForm(
+            name=conf.name,
+            maxAttendees=conf.maxAttendees,
+            seatsAvailable=conf.seatsAvailable,
+            fillRate=fill_rate,
+            registrations=totals.get('registrations', 0),
+            sessions=totals.get('sessions', 0),
+            wishlists=totals.get('wishlists', 0),
+            registrationsHourly=series('hour'),
+            registrationsDaily=series('day'),
+            sessionsByType=countForms(
+                analytics.breakdown(totals, 'sessions', 'type')),
+            sessionsByDay=countForms(
+                analytics.breakdown(totals, 'sessions', 'day')),
+            wishlistsByType=countForms(
+                analytics.breakdown(totals, 'wishlists', 'type')),
+            wishlistsByDay=countForms(
+                analytics.breakdown(totals, 'wishlists', 'day')),
         )
 
 
@@ -635,34 +1004,24 @@ class ConferenceApi(remote.Service):
         q = q.filter(Conference.month==6)
 
         return ConferenceForms(
-            items=[self._copyConferenceToForm(conf, "") for conf in q]
+            items=mappers.CONFERENCE.copyMany(q)
         )
 
 # - - - Sessions - - - - - - - - - - - - - - - - - - - -
 
     def _copySessionToForm(self, session):
-        """Copy relevant fields from Conference to ConferenceForm."""
-        # copy relevant fields from Sesson to SessionForm
-        sf = SessionForm()
-        for field in sf.all_fields():
-            if hasattr(session, field.name):
-                # convert typeOfSession; just copy others
-                if field.name == "typeOfSession":
-                    setattr(sf, field.name, getattr(TypeOfSession, getattr(session, field.name)))
-                else:
-                    setattr(sf, field.name, getattr(session, field.name))
-        sf.check_initialized()
-        return sf
+        """Copy relevant fields from Session to SessionForm."""
+        return mappers.SESSION.copy(session)
 
-    def _sessionAdd(self, request):
-        """Create a Session """
-        prof = self._getProfileFromUser()  # get user Profile
+    def _getOwnConference(self, wsck):
+        """Return the key of a conference, checking the user organizes it."""
+        prof = self._getProfileFromUserAsync()  # get user Profile
 
         # check if conf exists given websafeConfKey
         # get conference; check that it exists
-        wsck = request.websafeConferenceKey
         conf_k = ndb.Key(urlsafe=wsck)
-        conf = conf_k.get()
+        conf = conf_k.get_async()
+        prof, conf = prof.get_result(), conf.get_result()
         if not conf:
             raise endpoints.NotFoundException(
                 'No conference found with key: %s' % wsck)
@@ -670,50 +1029,125 @@ class ConferenceApi(remote.Service):
         if prof.mainEmail != conf.organizerUserId:
             raise endpoints.NotFoundException(
                 'Cannont create a sessions from this conference')
+        return conf_k
+
+    def _sessionData(self, form):
+        """Check a SessionForm and return its fields as Session data."""
+        if not form.name:
+            raise endpoints.BadRequestException("Session 'name' field required")
         # Check for valid time
-        if 24 < request.startTime or 0 >= request.startTime:
+        if 24 < form.startTime or 0 >= form.startTime:
             raise endpoints.NotFoundException(
                 'Invalid time, Please use 24 hour format. e.g 17')
-        data = {field.name: getattr(request, field.name) for field in request.all_fields()}
-        del data['websafeConferenceKey']
+        data = {field.name: getattr(form, field.name) for field in SessionForm.all_fields()}
 
+        if data['speaker']:
+            data['speaker'] = ' '.join(data['speaker'].split())
         if not data['typeOfSession']:
             data['typeOfSession'] = "NOT_SPECIFIED"
         else:
             data['typeOfSession'] = data['typeOfSession'].name
-        # Allocates a range of key IDs for this model class.
-        s_id = Session.allocate_ids(size=1, parent=conf_k)[0]
+        return data
+
+    def _sessionAdd(self, request):
+        """Create a Session """
+        wsck = request.websafeConferenceKey
+        data = self._sessionData(request)
+        # Allocates a range of key IDs for this model class,
+        # while the profile and conference are checked
+        s_ids = Session.allocate_ids_async(size=1, parent=ndb.Key(urlsafe=wsck))
+        conf_k = self._getOwnConference(wsck)
+
         # Create a Session key the includes session and parent info
-        s_key = ndb.Key(Session, s_id, parent=conf_k)
+        s_key = ndb.Key(Session, s_ids.get_result()[0], parent=conf_k)
         data['key'] = s_key
         session = Session(**data)
-        s = session.put()
-        # Added a task to check for feature speaker
+        self._putSessions(conf_k, [session])
+        # Added a task to refresh the feature speaker
+        task = taskqueue.Queue().add_async(taskqueue.Task(
+            url='/tasks/set_Featured_Speaker', params={'key': wsck}))
+        confcache.invalidate(conf_k)
+        task.get_result()
+        return self._copySessionToForm(session)
+
+    def _sessionsAdd(self, request):
+        """Create many Sessions of a conference at once."""
+        wsck = request.websafeConferenceKey
+        if not request.sessions:
+            raise endpoints.BadRequestException('No sessions given')
+        if len(request.sessions) > MAX_SESSIONS_PER_BATCH:
+            raise endpoints.BadRequestException(
+                'At most %d sessions per request' % MAX_SESSIONS_PER_BATCH)
+
+        # validate everything before writing anything
+        datas = []
+        for i, form in enumerate(request.sessions):
+            try:
+                datas.append(self._sessionData(form))
+            except endpoints.ServiceException as e:
+                raise type(e)('Session %d: %s' % (i, e))
+
+        # one id allocation for the whole batch, while the
+        # profile and conference are checked
+        s_ids = Session.allocate_ids_async(size=len(datas),
+                                           parent=ndb.Key(urlsafe=wsck))
+        conf_k = self._getOwnConference(wsck)
+        first, last = s_ids.get_result()
+        sessions = [Session(key=ndb.Key(Session, s_id, parent=conf_k), **data)
+                    for s_id, data in zip(range(first, last + 1), datas)]
+        for i in range(0, len(sessions), SESSION_PUT_CHUNK):
+            self._putSessions(conf_k, sessions[i:i + SESSION_PUT_CHUNK])
+        confcache.invalidate(conf_k)
+        # a single featured speaker refresh for the whole batch
         taskqueue.add(url='/tasks/set_Featured_Speaker',\
-                      params={'key': wsck, 'speaker': data['speaker']})
-        return self._copySessionToForm(s.get())
+                      params={'key': wsck})
+        return SessionForms(sessions=mappers.SESSION.copyMany(sessions))
+
+    @ndb.transactional()
+    def _putSessions(self, conf_k, sessions, removed=()):
+        """
+        Store Sessions of a conference and update its SpeakerIndex and
+        the Speakers by the delta: new/updated sessions are added, the
+        previous versions of updated sessions and deleted sessions are
+        passed as removed.
+        """
+        index = SpeakerIndex.forConference(conf_k)
+        for session in removed:
+            index.remove(session)
+        for session in sessions:
+            index.add(session)
+        ndb.put_multi(list(sessions) + [index])
+        fulltext.enqueueIndex(set([session.key for session in sessions] +
+                                  [session.key for session in removed]))
+        speakers.enqueueChanges(sessions, removed)
+        analytics.recordEvents(analytics.sessionEvents(sessions, removed))
 
     @ndb.transactional(retries=2)
     def _wishlistAdd(self, request):
         """
         Let users wishlist session, and increase wishlist count each
-        time a sessions is wishlisted
+        time a sessions is wishlisted. The count is buffered and folded
+        into the Session by the wishlist fold cron, so popular sessions
+        are not written on every wishlisting.
         """
-        prof = self._getProfileFromUser()  # get user Profile
-        s_key = request.websafeSessionsKey
-        session = ndb.Key(urlsafe=s_key).get()
-        if s_key in prof.wishlist:
+        # get user Profile and the registrations for the ProfileForm
+        prof, conf_keys = self._getProfileAndAttendingAsync().get_result()
+        s_key = ndb.Key(urlsafe=request.websafeSessionsKey)
+        if s_key in prof.wishlistKeys:
             raise endpoints.NotFoundException(
                 'Sessions is already on your wishlist')
-        prof.wishlist.append(s_key)
-        session.wishlisted += 1
-        prof.put()
-        session.put()
-        return self._copyProfileToForm(prof)
+        prof.wishlistKeys.append(s_key)
+        put = prof.put_async()
+        leaderboard.recordWishlist(s_key.urlsafe())
+        analytics.recordEvents([analytics.wishlistEvent(s_key)])
+        put.get_result()
+        return self._copyProfileToForm(prof, conf_keys)
 
     def _querySessions(self, filters, key=None):
         """
-        Gernal query used for searching Sessions.
+        Plan the query of Sessions matching filters, in one conference
+        when key is given. Returns (query, predicates), the predicates
+        being the filters the datastore can't apply, see planner.plan.
         """
         if key:
             # get Conference object from request; bail if not found
@@ -726,100 +1160,85 @@ class ConferenceApi(remote.Service):
         else:
             q = Session.query()
 
-        if filters:
-            inequality_filter, filters, excluded_values = self._formatMutliInequality(filters)
-            # If exists, sort on inequality filter first
-            if inequality_filter:
-                q = q.order(ndb.GenericProperty(inequality_filter))
-
-            q = q.order(Session.startTime)
-            q = q.order(Session.name)
-
-            for filtr in filters:
-                formatted_query = ndb.query.FilterNode(filtr["field"], filtr["operator"], filtr["value"])
-                q = q.filter(formatted_query)
-
-            if excluded_values:
-                """
-                This code is used to solve query extra credit problem.
-                Create list of session types but exclude the not equal to type
-                """
-                # Create list by turning TypeOfSession EMUN into dict then
-                # filtered out values that are in the excluded_values list.
-                typeOfSession = [typeOfSession for typeOfSession in \
-                                 TypeOfSession.to_dict() if typeOfSession\
-                                 not in excluded_values]
-                FilterList = []
-                # Add additional filter to query
-                for i in typeOfSession:
-                    FilterList.append(ndb.query.FilterNode('typeOfSession', '=', i))
-
-                q = q.filter(ndb.OR(*FilterList))
-
-        return q
+        if not filters:
+            return q, []
+        return planner.plan(q, self._formatSessionFilters(filters),
+                            order=('startTime', 'name'))
 
-    def _formatMutliInequality(self, filters):
-        """Parse, check validity and format user supplied filters."""
+    def _formatSessionFilters(self, filters):
+        """
+        Parse and check user supplied Session filters, returning them as
+        (property, operator, value) with values of the property's type.
+        """
         formatted_filters = []
-        excluded_values = []
-        inequality_field = None
         for f in filters:
-            filtr = {field.name: getattr(f, field.name) for field in f.all_fields()}
-            # Converting START_TIME to int
-            if filtr["field"] == "START_TIME":
-                filtr["value"] = int(filtr["value"])
-            # Checking to see if all field are valid.
             try:
-                filtr["field"] = FIELDS[filtr["field"]]
-                filtr["operator"] = OPERATORS[filtr["operator"]]
+                field = FIELDS[f.field]
+                op = OPERATORS[f.operator]
             except KeyError:
-                raise endpoints.BadRequestException("Filter contains invalid\
-                field or operator.")
-
-            # Every operation except "=" is an inequality
-            if filtr["operator"] != "=":
-                """
-                Remove session type inequality part of my solution for solving
-                the query problem asked for extra credit, also only allow not
-                equal inequality for operator because checking for types less
-                then 'WORKSHOP' makes no sense.
-                """
-                if filtr["field"] == "typeOfSession":
-                    # Only add the not equal operator.
-                    if filtr["operator"] != "!=":
-                        raise endpoints.BadRequestException("Can only one \
-                            exclude values ")
-                    # Add all good values to list.
-                    excluded_values.append(filtr["value"].upper())
-                    continue
-                if inequality_field and inequality_field != filtr["field"]:
-                    raise endpoints.BadRequestException("Inequality filter is\
-                    allowed on only one field.")
-                else:
-                    inequality_field = filtr["field"]
-
-            formatted_filters.append(filtr)
-        return (inequality_field, formatted_filters, excluded_values)
+                raise endpoints.BadRequestException(
+                    "Filter contains invalid field or operator.")
+            value = f.value
+            if field in ('startTime', 'duration', 'dayofConf'):
+                try:
+                    value = int(value)
+                except (TypeError, ValueError):
+                    raise endpoints.BadRequestException(
+                        "%s needs a number." % f.field)
+            elif field == 'typeOfSession':
+                value = (value or '').upper()
+                if value not in TypeOfSession.to_dict():
+                    raise endpoints.BadRequestException(
+                        'Not a valid session type')
+            elif field not in ('speaker',):
+                raise endpoints.BadRequestException(
+                    "Filter contains invalid field or operator.")
+            formatted_filters.append((field, op, value))
+        return formatted_filters
+
+    def _getConferenceSessions(self, websafeConferenceKey, view=View.FULL):
+        """
+        Return SessionForms of all sessions of a conference, from the
+        conference cache when possible. The SUMMARY view is read with a
+        projection query into summaries.
+        """
+        conf_k = ndb.Key(urlsafe=websafeConferenceKey)
+        summary = view == View.SUMMARY
+        cache_key = confcache.entryKey(
+            conf_k, 'sessions_summary' if summary else 'sessions')
+        forms = confcache.get(cache_key, SessionForms)
+        if forms is None:
+            # run the conference check and the session query together
+            conf = conf_k.get_async()
+            q = Session.query(ancestor=conf_k)
+            if summary:
+                sessions = q.fetch_async(
+                    projection=mappers.SESSION_SUMMARY.properties)
+            else:
+                sessions = q.fetch_async()
+            # get Conference object from request; bail if not found
+            if not conf.get_result():
+                raise endpoints.NotFoundException(
+                    'No conference found with key: %s' % websafeConferenceKey)
+            if summary:
+                forms = SessionForms(summaries=mappers.SESSION_SUMMARY.copyMany(
+                    sessions.get_result()))
+            else:
+                forms = SessionForms(
+                    sessions=mappers.SESSION.copyMany(sessions.get_result()))
+            confcache.set(cache_key, forms)
+        return forms
 
-    @endpoints.method(CONF_GET_REQUEST, SessionForms,
+    @endpoints.method(SESS_GET_REQUEST, SessionForms,
             path='conference/{websafeConferenceKey}/sessions',
             http_method='GET', name='getConferenceSessions')
     def getConferenceSessions(self, request):
         """
-        Return requested sessions for a conference (by websafeConferenceKey).
+        Return requested sessions for a conference (by websafeConferenceKey),
+        as summaries for the SUMMARY view.
         """
-        # get Conference object from request; bail if not found
-        conf_k = ndb.Key(urlsafe=request.websafeConferenceKey)
-        conf = conf_k.get()
-        if not conf:
-            raise endpoints.NotFoundException(
-                'No conference found with key: %s' % request.websafeConferenceKey)
-
-        sessions = Session.query(ancestor=conf_k)
-
-        # return ConferenceForm
-        return SessionForms(sessions=[self._copySessionToForm(sess)\
-                            for sess in sessions])
+        return self._getConferenceSessions(request.websafeConferenceKey,
+                                           request.view)
 
     @endpoints.method(message_types.VoidMessage, SessionForms,
         path='getMostWishlisted',
@@ -830,9 +1249,38 @@ class ConferenceApi(remote.Service):
         See which sessions Users are most excited about, by getting
         the top 10 most wishlisted sessions.
         """
-        sessions = Session.query(Session.wishlisted > 0 ).order(-Session.wishlisted).fetch(10)
-        return SessionForms(sessions=[self._copySessionToForm(sess)\
-                            for sess in sessions])
+        return self._getLeaderboard(leaderboard.GLOBAL_BOARD)
+
+    @endpoints.method(CONF_GET_REQUEST, SessionForms,
+        path='conference/{websafeConferenceKey}/getMostWishlisted',
+        http_method='GET', name='getConferenceMostWishlisted')
+    def getConferenceMostWishlisted(self, request):
+        """Get the top 10 most wishlisted sessions of a conference."""
+        wsck = request.websafeConferenceKey
+        try:
+            conf_k = ndb.Key(urlsafe=wsck)
+        except Exception:
+            conf_k = None
+        if not conf_k or conf_k.kind() != 'Conference' or not conf_k.get():
+            raise endpoints.NotFoundException(
+                'No conference found with key: %s' % wsck)
+        return self._getLeaderboard(conf_k.urlsafe())
+
+    def _getLeaderboard(self, board_id):
+        """
+        Return the SessionForms of a wishlist leaderboard, from memcache
+        unless the leaderboard changed since it was last read.
+        """
+        memKey = leaderboard.MEMCACHE_LEADERBOARD_PREFIX + board_id
+        data = memcache.get(memKey)
+        if data is not None:
+            return protobuf.decode_message(SessionForms, data)
+        board = leaderboard.getBoard(board_id)
+        sessions = ndb.get_multi(board.sessionKeys())
+        forms = SessionForms(sessions=mappers.SESSION.copyMany(
+            sess for sess in sessions if sess))
+        memcache.set(memKey, protobuf.encode_message(forms))
+        return forms
 
     @endpoints.method(SINGLE_POST_REQUEST, SessionForms,
         path='conference/{websafeConferenceKey}/getSessionsPerDay',
@@ -842,26 +1290,21 @@ class ConferenceApi(remote.Service):
         Second of the additional queries.
         Get all conference sessions during a day
         """
-        key = ndb.Key(urlsafe=request.websafeConferenceKey)
-        conf = key.get()
-        if not conf:
-            raise endpoints.NotFoundException(
-                'No conference found with key: %s' % key)
         # Check is values are valid
         if request.field != "DAY" or request.operator not in OPERATORS:
             raise endpoints.NotFoundException('Can only filter by day or\
              check operator')
         # Make sure value is number
         try:
-            int(request.value)
+            day = int(request.value)
         except:
             raise endpoints.NotFoundException('Please use a number')
-        sessions = Session.query(ancestor=key).\
-            filter(ndb.query.FilterNode(FIELDS[request.field],\
-            OPERATORS[request.operator], int(request.value))).\
-            order(Session.startTime)
-        return SessionForms(sessions=[self._copySessionToForm(sess)\
-                            for sess in sessions])
+        # filter the cached sessions of the conference
+        compare = planner.COMPARATORS[OPERATORS[request.operator]]
+        forms = self._getConferenceSessions(request.websafeConferenceKey)
+        sessions = [sf for sf in forms.sessions if compare(sf.dayofConf, day)]
+        sessions.sort(key=lambda sf: sf.startTime)
+        return SessionForms(sessions=sessions)
 
     @endpoints.method(SINGLE_POST_REQUEST, SessionForms,
         path='conference/{websafeConferenceKey}/sessionsByType',
@@ -871,24 +1314,20 @@ class ConferenceApi(remote.Service):
         Given a conference, return all sessions of a specified type
         (eg lecture, keynote, workshop)
         """
-        key = ndb.Key(urlsafe=request.websafeConferenceKey)
-        conf = key.get()
         value = request.value.upper()
-        if not conf:
-            raise endpoints.NotFoundException(
-                'No conference found with key: %s' % key)
         # Check if field and operation are valid
         if request.field != "TYPE" or request.operator not in OPERATORS:
             raise endpoints.NotFoundException('Can only filter by type or check operator')
         # Check if value is valid
         if value not in TypeOfSession.to_dict():
             raise endpoints.NotFoundException('Not a valid session type')
-        sessions = Session.query(ancestor=key).\
-            filter(ndb.query.FilterNode(FIELDS[request.field],\
-            OPERATORS[request.operator], value)).\
-            order(Session.startTime)
-        return SessionForms(sessions=[self._copySessionToForm(sess)\
-                            for sess in sessions])
+        # filter the cached sessions of the conference
+        compare = planner.COMPARATORS[OPERATORS[request.operator]]
+        forms = self._getConferenceSessions(request.websafeConferenceKey)
+        sessions = [sf for sf in forms.sessions
+                    if compare(sf.typeOfSession.name, value)]
+        sessions.sort(key=lambda sf: sf.startTime)
+        return SessionForms(sessions=sessions)
 
     @endpoints.method(SpeakerSessionQueryForm, SessionForms,
         path='speakers',
@@ -896,11 +1335,28 @@ class ConferenceApi(remote.Service):
     def getSessionsBySpeakers(self, request):
         """
         Given a speaker, return all sessions given by this particular
-        speaker, acroos all conferences.
+        speaker, acroos all conferences, read through the Speaker index.
         """
-        sessions = Session.query(Session.speaker == request.speaker.lower())
-        return SessionForms(sessions=[self._copySessionToForm(sess)\
-                            for sess in sessions])
+        if not Speaker.keyFor(request.speaker):
+            raise endpoints.BadRequestException("'speaker' field required")
+        s_keys = speakers.sessionKeys(request.speaker)
+        sessions = [session for session in ndb.get_multi(s_keys) if session]
+        if request.view == View.SUMMARY:
+            return SessionForms(
+                summaries=mappers.SESSION_SUMMARY.copyMany(sessions))
+        return SessionForms(sessions=mappers.SESSION.copyMany(sessions))
+
+    @endpoints.method(PAGE_GET_REQUEST, SpeakerForms,
+        path='speakers',
+        http_method='GET', name='getSpeakers')
+    def getSpeakers(self, request):
+        """List the speakers by name, with their number of sessions."""
+        speakers_page, next_token = self._fetchPage(Speaker.query(), request)
+        return SpeakerForms(
+            speakers=[SpeakerForm(name=speaker.name,
+                                  sessionCount=len(speaker.sessionKeys))
+                      for speaker in speakers_page],
+            nextPageToken=next_token)
 
     @endpoints.method(QUERY_POST_REQUEST, SessionForms,
         path='conference/{websafeConferenceKey}/sessions',
@@ -908,10 +1364,44 @@ class ConferenceApi(remote.Service):
     def getQuerySessions(self, request):
         """
         Query all sessions in a conference, use for credit extra problem.
+        Results are returned one page at a time.
         """
-        sessions = self._querySessions(request.filters, request.websafeConferenceKey)
-        return SessionForms(sessions=[self._copySessionToForm(sess)\
-                            for sess in sessions])
+        q, predicates = self._querySessions(request.filters,
+                                            request.websafeConferenceKey)
+        summary = request.view == View.SUMMARY
+        if predicates:
+            # post-filtering reads every property it tests, so no projection
+            sessions, next_token = self._fetchFilteredPage(q, predicates,
+                                                           request)
+            if summary:
+                return SessionForms(
+                    summaries=mappers.SESSION_SUMMARY.copyMany(sessions),
+                    nextPageToken=next_token)
+        elif summary:
+            summaries, next_token = self._fetchSummaryPage(
+                q, request, mappers.SESSION_SUMMARY)
+            return SessionForms(summaries=summaries, nextPageToken=next_token)
+        else:
+            sessions, next_token = self._fetchPage(q, request)
+        return SessionForms(sessions=mappers.SESSION.copyMany(sessions),
+                            nextPageToken=next_token)
+
+    @endpoints.method(SearchForm, SessionForms,
+        path='searchSessions',
+        http_method='POST', name='searchSessions')
+    def searchSessions(self, request):
+        """
+        Full-text search of session names, highlights and speakers, in
+        one conference when websafeConferenceKey is given.
+        """
+        query_string = request.query
+        if request.websafeConferenceKey:
+            query_string = '(%s) conference:"%s"' % (
+                query_string, request.websafeConferenceKey)
+        sessions, next_token = self._search(
+            fulltext.SESSION_INDEX, query_string, request)
+        return SessionForms(sessions=mappers.SESSION.copyMany(sessions),
+                            nextPageToken=next_token)
 
     @endpoints.method(SESS_POST_REQUEST, SessionForm,
             path='conference/{websafeConferenceKey}/session',
@@ -920,6 +1410,13 @@ class ConferenceApi(remote.Service):
         """Creat a session for a conference."""
         return self._sessionAdd(request)
 
+    @endpoints.method(SESSIONS_POST_REQUEST, SessionForms,
+            path='conference/{websafeConferenceKey}/sessions/batch',
+            http_method='POST', name='createSessions')
+    def createSessions(self, request):
+        """Create many sessions for a conference, e.g. a whole agenda."""
+        return self._sessionsAdd(request)
+
     @endpoints.method(WISHLIST_POST_REQUEST, ProfileForm,
             path='session/{websafeSessionsKey}/addSessionToWishlist',
             http_method='POST', name='addSessionToWishlist')
@@ -928,14 +1425,74 @@ class ConferenceApi(remote.Service):
         Adds the sessions to the user's list of
         sessions the are interested in attending.
         """
+        # checked outside the Profile's transaction, as another entity group
+        try:
+            s_key = ndb.Key(urlsafe=request.websafeSessionsKey)
+        except Exception:
+            s_key = None
+        if not s_key or s_key.kind() != 'Session' or not s_key.get():
+            raise endpoints.NotFoundException(
+                'No session found with key: %s' % request.websafeSessionsKey)
         return self._wishlistAdd(request)
 
-    @endpoints.method(message_types.VoidMessage, SessionForms,
+    @endpoints.method(PAGE_GET_REQUEST, SessionForms,
             path='profile/wishlist', http_method='GET',
             name='getSessionsInWishlist')
     def getSessionsInWishlist(self, request):
-        """Get all sessions on user wishlist."""
-        return self._getWishlist()
+        """Get the sessions on user wishlist, one page at a time."""
+        return self._getWishlist(request)
+
+    @ndb.tasklet
+    def _getSessionSlotsAsync(self, conf_k):
+        """
+        Return the slots of a conference's Sessions in timeline order,
+        from the conference cache when possible.
+        """
+        cache_key = confcache.entryKey(conf_k, 'slots')
+        forms = confcache.get(cache_key, SessionSlotForms)
+        if forms is None:
+            sessions = yield Session.query(ancestor=conf_k).fetch_async()
+            forms = SessionSlotForms(slots=schedule.sortSlots(
+                mappers.SESSION_SLOT.copyMany(sessions)))
+            confcache.set(cache_key, forms)
+        raise ndb.Return(forms.slots)
+
+    @endpoints.method(message_types.VoidMessage, ScheduleForm,
+            path='profile/schedule', http_method='GET',
+            name='getMySchedule')
+    def getMySchedule(self, request):
+        """
+        Return the user's wishlisted sessions as a timeline per conference
+        day, flagging the ones that overlap and suggesting free sessions
+        by the same speaker or of the same type instead.
+        """
+        prof = self._getProfileFromUser()
+        wishlisted = set(s_key.urlsafe() for s_key in prof.wishlistKeys)
+        conf_keys = []
+        for s_key in prof.wishlistKeys:
+            conf_k = s_key.parent()
+            if conf_k not in conf_keys:
+                conf_keys.append(conf_k)
+        # the slots of all the conferences are fetched together
+        futures = [self._getSessionSlotsAsync(conf_k) for conf_k in conf_keys]
+
+        days, conflicts = [], 0
+        for conf_k, future in zip(conf_keys, futures):
+            conf_slots = future.get_result()
+            # sessions deleted since they were wishlisted have no slot
+            mine = [slot for slot in conf_slots
+                    if slot.websafeSessionKey in wishlisted]
+            for day, items in schedule.buildDays(mine, conf_slots):
+                days.append(ScheduleDayForm(
+                    websafeConferenceKey=conf_k.urlsafe(), dayofConf=day,
+                    items=[ScheduleItemForm(session=slot,
+                                            conflictsWith=conflicting,
+                                            alternatives=alternatives)
+                           for slot, conflicting, alternatives in items]))
+                conflicts += sum(len(conflicting)
+                                 for slot, conflicting, alternatives in items)
+        # every overlapping pair is flagged on both of its sessions
+        return ScheduleForm(days=days, conflicts=conflicts // 2)
 
     @endpoints.method(CONF_GET_REQUEST, FeatureSpeaker,
             path='conference/{websafeConferenceKey}/getFeatureSpeaker',
@@ -947,13 +1504,19 @@ class ConferenceApi(remote.Service):
         """
         speakerMemKey = SPEAKER_ANNOUNCEMENTS_KEY + request.websafeConferenceKey
         data = memcache.get(speakerMemKey)
-        if data is not None:
+        if data is None:
+            # not cached (or evicted), read it from the speaker index
+            data = self._featuredSpeaker(
+                ndb.Key(urlsafe=request.websafeConferenceKey))
+            memcache.set(speakerMemKey, data)
+        if data:
             return FeatureSpeaker(
                 name= data['name'],
                 conf_name= data['conf_name'],
                 sessions= data['sessions']
             )
         else:
-            raise endpoints.NotFoundException('Not a valid Memcache id')
+            raise endpoints.NotFoundException('No featured speaker')
 
-api = endpoints.api_server([ConferenceApi])  # register API
+api = instrumentation.Middleware(
+    endpoints.api_server([ConferenceApi]))  # register API
@@ -0,0 +1,111 @@
+#!/usr/bin/env python
+
+"""
+fulltext.py -- full-text search over Conferences and Sessions
+
+Conferences and Sessions are mirrored into two Search API indexes, one
+document per entity with its urlsafe key as the doc_id. Writes enqueue an
+index task (transactionally inside a transaction), so the documents follow
+the entities without slowing the writes down; deleted entities have their
+documents removed by the same task. Searches are ranked by relevance and
+return entity keys, one cursor-paged page at a time.
+
+"""
+
+from google.appengine.api import search
+from google.appengine.api import taskqueue
+from google.appengine.ext import ndb
+
+from models import Conference
+from models import Session
+
+CONFERENCE_INDEX = 'conferences'
+SESSION_INDEX = 'sessions'
+INDEX_TASK_URL = '/tasks/index_documents'
+PUT_BATCH = 200  # most documents Index.put/delete take at once
+
+
+def conferenceDocument(conf):
+    """Return the search document of a Conference."""
+    fields = [
+        search.TextField(name='name', value=conf.name),
+        search.TextField(name='description', value=conf.description),
+        search.TextField(name='city', value=conf.city),
+        search.AtomField(name='organizer', value=conf.organizerUserId),
+    ]
+    fields.extend(search.TextField(name='topics', value=topic)
+                  for topic in conf.topics)
+    if conf.startDate:
+        fields.append(search.DateField(name='startDate', value=conf.startDate))
+    return search.Document(doc_id=conf.key.urlsafe(), fields=fields)
+
+
+def sessionDocument(session):
+    """Return the search document of a Session."""
+    return search.Document(doc_id=session.key.urlsafe(), fields=[
+        search.TextField(name='name', value=session.name),
+        search.TextField(name='highlights', value=session.highlights),
+        search.TextField(name='speaker', value=session.speaker),
+        search.AtomField(name='typeOfSession', value=session.typeOfSession),
+        search.AtomField(name='conference',
+                         value=session.key.parent().urlsafe()),
+    ])
+
+
+INDEXES = {
+    Conference._get_kind(): (CONFERENCE_INDEX, conferenceDocument),
+    Session._get_kind(): (SESSION_INDEX, sessionDocument),
+}
+
+
+def enqueueIndex(keys):
+    """
+    (Re)index the entities of keys in a task, transactional inside a
+    transaction; keys of deleted entities have their documents removed.
+    """
+    keys = list(keys)
+    if keys:
+        taskqueue.add(url=INDEX_TASK_URL,
+                      params={'keys': [key.urlsafe() for key in keys]},
+                      transactional=ndb.in_transaction())
+
+
+def indexEntities(keys):
+    """Put the documents of the entities of keys, deleting missing ones."""
+    docs, deleted = {}, {}
+    for key, entity in zip(keys, ndb.get_multi(keys)):
+        index_name, makeDocument = INDEXES[key.kind()]
+        if entity:
+            docs.setdefault(index_name, []).append(makeDocument(entity))
+        else:
+            deleted.setdefault(index_name, []).append(key.urlsafe())
+    for index_name, batch in docs.items():
+        index = search.Index(name=index_name)
+        for i in range(0, len(batch), PUT_BATCH):
+            index.put(batch[i:i + PUT_BATCH])
+    for index_name, doc_ids in deleted.items():
+        index = search.Index(name=index_name)
+        for i in range(0, len(doc_ids), PUT_BATCH):
+            index.delete(doc_ids[i:i + PUT_BATCH])
+
+
+def searchKeys(index_name, query_string, page_size, page_token=None):
+    """
+    Return one page of the keys of the entities matching query_string,
+    best match first, and the token of the next page (None on the last).
+    Raises search.QueryError for a malformed query.
+    """
+    cursor = search.Cursor(web_safe_string=page_token) if page_token \
+        else search.Cursor()
+    options = search.QueryOptions(
+        limit=page_size, cursor=cursor, ids_only=True,
+        sort_options=search.SortOptions(
+            match_scorer=search.MatchScorer(),
+            expressions=[search.SortExpression(
+                expression='_score', default_value=0,
+                direction=search.SortExpression.DESCENDING)]))
+    results = search.Index(name=index_name).search(
+        search.Query(query_string=query_string, options=options))
+    keys = [ndb.Key(urlsafe=doc.doc_id) for doc in results.results]
+    next_token = results.cursor.web_safe_string if results.cursor else None
+    return keys, next_token
@@ -0,0 +1,136 @@
+#!/usr/bin/env python
+
+"""
+instrumentation.py -- per-request RPC cost accounting
+
+Middleware wraps a WSGI app (the Endpoints API server or the webapp2 app)
+and, for every request, counts and times the datastore, memcache and
+taskqueue RPCs the request makes, along with its wall time and response
+size. Each request is logged as one JSON line and added to aggregate
+counters in memcache, which endpointStats() reads back.
+
+"""
+
+import json
+import logging
+import threading
+import time
+
+from google.appengine.api import apiproxy_stub_map
+from google.appengine.api import memcache
+
+STATS_PREFIX = 'ENDPOINT_STATS_'
+SERVICES = {
+    'datastore_v3': 'datastore',
+    'memcache': 'memcache',
+    'taskqueue': 'taskqueue',
+}
+COUNTERS = ['requests', 'wall_ms', 'bytes'] + [
+    '%s_%s' % (name, measure) for name in sorted(SERVICES.values())
+    for measure in ('calls', 'ms')]
+
+_local = threading.local()
+
+
+def _preCall(service, call, request, response, rpc):
+    stats = getattr(_local, 'stats', None)
+    if stats is not None and service in SERVICES:
+        _local.started[id(rpc)] = time.time()
+
+
+def _postCall(service, call, request, response, rpc):
+    stats = getattr(_local, 'stats', None)
+    if stats is not None and service in SERVICES:
+        name = SERVICES[service]
+        stats[name + '_calls'] += 1
+        started = _local.started.pop(id(rpc), None)
+        if started is not None:
+            stats[name + '_ms'] += (time.time() - started) * 1000
+
+
+apiproxy_stub_map.apiproxy.GetPreCallHooks().Append(
+    'instrumentation', _preCall)
+apiproxy_stub_map.apiproxy.GetPostCallHooks().Append(
+    'instrumentation', _postCall)
+
+
+def endpointName(path):
+    """Return the name stats are recorded under for a request path."""
+    # Endpoints API calls arrive as /_ah/spi/ConferenceApi.methodName
+    if path.startswith('/_ah/spi/'):
+        return path[len('/_ah/spi/'):]
+    return path
+
+
+def record(name, status, stats):
+    """Log the stats of one request and add them to the aggregates."""
+    line = dict((counter, int(round(value))) for counter, value in
+                stats.items())
+    line.update(endpoint=name, status=status)
+    logging.info('endpoint_stats %s', json.dumps(line, sort_keys=True))
+    # recorded after the request, so this RPC is not counted itself
+    memcache.offset_multi(
+        dict((counter, line[counter]) for counter in COUNTERS),
+        key_prefix='%s%s_' % (STATS_PREFIX, name), initial_value=0)
+
+
+def endpointStats(names, limit=None):
+    """
+    Return the aggregate stats of the named endpoints, hottest (most
+    total wall time) first, with the per-request averages.
+    """
+    keys = ['%s_%s' % (name, counter) for name in names for counter in COUNTERS]
+    values = memcache.get_multi(keys, key_prefix=STATS_PREFIX)
+    endpoints = []
+    for name in names:
+        totals = dict((counter, values.get('%s_%s' % (name, counter), 0))
+                      for counter in COUNTERS)
+        if not totals['requests']:
+            continue
+        totals['endpoint'] = name
+        totals['average'] = dict(
+            (counter, round(float(totals[counter]) / totals['requests'], 2))
+            for counter in COUNTERS if counter != 'requests')
+        endpoints.append(totals)
+    endpoints.sort(key=lambda e: e['wall_ms'], reverse=True)
+    return endpoints[:limit] if limit else endpoints
+
+
+class Middleware(object):
+    """WSGI middleware recording the cost of every request."""
+
+    def __init__(self, app):
+        self.app = app
+
+    def __getattr__(self, name):
+        # keep the wrapped app's attributes (router, config, ...) reachable
+        return getattr(self.app, name)
+
+    def __call__(self, environ, start_response):
+        stats = dict((counter, 0) for counter in COUNTERS)
+        status = ['500']
+
+        def recordStatus(status_line, headers, exc_info=None):
+            status[0] = status_line.split(' ', 1)[0]
+            return start_response(status_line, headers, exc_info)
+
+        _local.stats, _local.started = stats, {}
+        start = time.time()
+        try:
+            result = self.app(environ, recordStatus)
+            try:
+                body = list(result)
+            finally:
+                if hasattr(result, 'close'):
+                    result.close()
+            stats['bytes'] = sum(len(chunk) for chunk in body)
+        finally:
+            stats['wall_ms'] = (time.time() - start) * 1000
+            stats['requests'] = 1
+            _local.stats, _local.started = None, None
+            try:
+                record(endpointName(environ.get('PATH_INFO', '')),
+                       status[0], stats)
+            except Exception:
+                logging.exception('Recording endpoint stats failed')
+        return body
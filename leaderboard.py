@@ -0,0 +1,110 @@
+#!/usr/bin/env python
+
+"""
+leaderboard.py -- materialized most-wishlisted Session leaderboards
+
+Each wishlist addition enqueues a pull task in the same transaction as the
+Profile write, instead of updating the hot Session. The fold cron leases
+the tasks in bulk, adds the summed deltas to Session.wishlisted with
+pullqueue.foldDeltas, so a task leased again after a failed fold is not
+counted twice, and merges the new counts into the global and
+per-conference WishlistLeaderboards, each in a transaction.
+
+"""
+
+from google.appengine.api import memcache
+from google.appengine.ext import ndb
+
+import confcache
+import pullqueue
+from models import Session
+from models import WishlistLeaderboard
+
+WISHLIST_QUEUE = 'wishlist-events'
+GLOBAL_BOARD = 'global'
+LEADERBOARD_SIZE = 10
+MEMCACHE_LEADERBOARD_PREFIX = 'WISHLIST_LEADERBOARD_'
+
+
+def recordWishlist(wssk):
+    """Buffer one wishlisting of a Session, see pullqueue.add."""
+    pullqueue.add(WISHLIST_QUEUE, wssk)
+
+
+def boardQuery(board_id):
+    """Return the query a board would be built from without buffering."""
+    if board_id == GLOBAL_BOARD:
+        q = Session.query()
+    else:
+        q = Session.query(ancestor=ndb.Key(urlsafe=board_id))
+    return q.filter(Session.wishlisted > 0).order(-Session.wishlisted)
+
+
+def getBoard(board_id):
+    """
+    Return the WishlistLeaderboard of board_id, seeding it from the
+    Session.wishlisted counts when it doesn't exist yet. A seeded board
+    is not saved; foldWishlists saves the boards it changes.
+    """
+    board = WishlistLeaderboard.get_by_id(board_id)
+    if not board:
+        sessions = boardQuery(board_id).fetch(LEADERBOARD_SIZE)
+        board = WishlistLeaderboard(id=board_id)
+        board.merge(dict((s.key.urlsafe(), s.wishlisted) for s in sessions),
+                    LEADERBOARD_SIZE)
+    return board
+
+
+def foldWishlists():
+    """
+    Apply one batch of buffered wishlistings to the Sessions and the
+    leaderboards, returning the number of events folded.
+    """
+    leased, sessions = pullqueue.foldDeltas(WISHLIST_QUEUE, _wishlistDeltas,
+                                            _addWishlisted)
+    if sessions:
+        _mergeBoards(sessions)
+    return leased
+
+
+def _wishlistDeltas(tasks):
+    deltas = {}
+    for task in tasks:
+        deltas.setdefault(ndb.Key(urlsafe=task.payload), []).append(
+            (task.name, 1))
+    return deltas
+
+
+def _addWishlisted(s_key, session, deltas):
+    # wishlistings of deleted sessions are dropped
+    if session:
+        session.wishlisted += sum(deltas)
+    return session
+
+
+@ndb.transactional()
+def _mergeBoard(board_id, counts, seeded):
+    board = WishlistLeaderboard.get_by_id(board_id) or seeded
+    board.merge(counts, LEADERBOARD_SIZE)
+    board.put()
+
+
+def _mergeBoards(sessions):
+    """Merge the counts of folded Sessions into their boards."""
+    # new counts per board: the global one and one per conference
+    counts = {GLOBAL_BOARD: {}}
+    for session in sessions:
+        wssk = session.key.urlsafe()
+        counts[GLOBAL_BOARD][wssk] = session.wishlisted
+        counts.setdefault(session.key.parent().urlsafe(), {})[wssk] = \
+            session.wishlisted
+
+    # seeding queries across entity groups, so it is done outside the
+    # board's transaction
+    for board_id, board_counts in counts.items():
+        _mergeBoard(board_id, board_counts, getBoard(board_id))
+    memcache.delete_multi(counts.keys(),
+                          key_prefix=MEMCACHE_LEADERBOARD_PREFIX)
+    for board_id in counts:
+        if board_id != GLOBAL_BOARD:
+            confcache.invalidate(ndb.Key(urlsafe=board_id))
@@ -12,10 +12,40 @@ created by wesc on 2014 may 24
 
 __author__ = 'wesc+api@google.com (Wesley Chun)'
 
+import json
+import time
+
 import webapp2
 from google.appengine.api import app_identity
 from google.appengine.api import mail
+from google.appengine.api import taskqueue
+from google.appengine.datastore.datastore_query import Cursor
+from google.appengine.ext import blobstore
+from google.appengine.ext import ndb
+from google.appengine.ext.webapp import blobstore_handlers
 from conference import ConferenceApi
+from models import BulkJob
+from models import Conference
+from models import Profile
+from models import Registration
+from models import Session
+import analytics
+import bulk
+import confcache
+import fulltext
+import instrumentation
+import leaderboard
+import notifications
+import pullqueue
+import querycache
+import seats
+import speakers
+
+
+def writeJson(response, data):
+    response.headers['Content-Type'] = 'application/json'
+    response.write(json.dumps(data, indent=2, sort_keys=True))
+
 
 class SetAnnouncementHandler(webapp2.RequestHandler):
     def get(self):
@@ -26,7 +56,10 @@ class SetAnnouncementHandler(webapp2.RequestHandler):
 
 class SendConfirmationEmailHandler(webapp2.RequestHandler):
     def post(self):
-        """Send email confirming Conference creation."""
+        """
+        Send email confirming Conference creation; only for the tasks
+        queued before the confirmation-emails pull queue.
+        """
         mail.send_mail(
             'noreply@%s.appspotmail.com' % (
                 app_identity.get_application_id()),     # from
@@ -37,14 +70,293 @@ class SendConfirmationEmailHandler(webapp2.RequestHandler):
                 'conferenceInfo')
         )
 
+class SendConfirmationEmailsHandler(webapp2.RequestHandler):
+    TIME_BUDGET = 480  # seconds, within the 10 minute task deadline
+
+    def get(self):
+        """Send the queued confirmation emails, batch by batch."""
+        self.post()
+
+    def post(self):
+        """Send the queued confirmation emails, batch by batch."""
+        start = time.time()
+        while time.time() - start < self.TIME_BUDGET:
+            if notifications.sendConfirmations() < notifications.LEASE_BATCH:
+                break
+        else:
+            notifications.scheduleSend()
+        self.response.set_status(204)
+
 class SetFeaturedSpeaker(webapp2.RequestHandler):
     def post(self):
         """Set featured speaker in Memcache"""
         ConferenceApi._cacheFeaturedSpeaker(self)
         self.response.set_status(204)
 
-app = webapp2.WSGIApplication([
+class FoldSeatsHandler(webapp2.RequestHandler):
+    def post(self):
+        """Fold seat shards into Conference.seatsAvailable."""
+        seats.foldSeats(ndb.Key(urlsafe=self.request.get('key')))
+        self.response.set_status(204)
+
+
+class AdjustSeatsHandler(webapp2.RequestHandler):
+    def post(self):
+        """Add or remove seats after maxAttendees changed."""
+        # the task name stays the same across retries of the task
+        seats.adjustSeats(ndb.Key(urlsafe=self.request.get('key')),
+                          int(self.request.get('delta')),
+                          self.request.headers['X-AppEngine-TaskName'])
+        self.response.set_status(204)
+
+class FoldQueueHandler(webapp2.RequestHandler):
+    MAX_BATCHES = 10
+
+    def get(self):
+        """Fold buffered events batch by batch, see pullqueue.fold."""
+        for i in range(self.MAX_BATCHES):
+            if self.fold() < pullqueue.LEASE_BATCH:
+                break
+        self.response.set_status(204)
+
+
+class FoldWishlistsHandler(FoldQueueHandler):
+    """Fold buffered wishlistings into Sessions and leaderboards."""
+    fold = staticmethod(leaderboard.foldWishlists)
+
+
+class FoldStatsHandler(FoldQueueHandler):
+    """Fold buffered statistics events into the conference rollups."""
+    fold = staticmethod(analytics.foldEvents)
+
+
+class CursorBatchHandler(webapp2.RequestHandler):
+    BATCH_SIZE = 100
+    FETCH_OPTIONS = {'keys_only': True}
+    PARAMS = ()  # request parameters passed on to the next batch
+
+    def post(self):
+        """
+        Pass one page of query() to batch(), one page per task, chaining
+        a task for the next page.
+        """
+        cursor = self.request.get('cursor')
+        cursor = Cursor(urlsafe=cursor) if cursor else None
+        results, next_cursor, more = self.query().fetch_page(
+            self.BATCH_SIZE, start_cursor=cursor, **self.FETCH_OPTIONS)
+        self.batch(results)
+        if more and next_cursor:
+            params = dict((name, self.request.get(name))
+                          for name in self.PARAMS if self.request.get(name))
+            params['cursor'] = next_cursor.urlsafe()
+            taskqueue.add(url=self.request.path, params=params)
+        self.response.set_status(204)
+
+
+class MigrateRegistrationsHandler(CursorBatchHandler):
+    """Move Profile.conferenceKeysToAttend to Registration entities."""
+
+    def query(self):
+        return Profile.query(Profile.conferenceKeysToAttend > '')
+
+    def batch(self, p_keys):
+        for p_key in p_keys:
+            Registration.migrateProfile(p_key)
+
+
+class MigrateWishlistsHandler(CursorBatchHandler):
+    """Move Profile.wishlist websafe keys to Profile.wishlistKeys."""
+
+    def query(self):
+        return Profile.query(Profile.wishlist > '')
+
+    def batch(self, p_keys):
+        for p_key in p_keys:
+            Profile.migrateWishlist(p_key)
+
+
+class UpdateOrganizerNameHandler(CursorBatchHandler):
+    """
+    Copy an organizer's displayName to their Conferences, or, without
+    a key, fill it in on every Conference.
+    """
+    PARAMS = ('key',)
+
+    def query(self):
+        p_key = self.request.get('key')
+        if p_key:
+            return Conference.query(ancestor=ndb.Key(urlsafe=p_key))
+        return Conference.query()
+
+    def batch(self, c_keys):
+        by_organizer = {}
+        for c_key in c_keys:
+            by_organizer.setdefault(c_key.parent(), []).append(c_key)
+        organizers = by_organizer.keys()
+        changed = []
+        for prof in ndb.get_multi(organizers):
+            if prof:
+                changed.extend(Conference.renameOrganizer(
+                    by_organizer[prof.key], prof.displayName))
+        for c_key in changed:
+            confcache.invalidate(c_key)
+        if changed:
+            # cached query pages carry organizer names
+            querycache.bump()
+
+
+class IndexDocumentsHandler(webapp2.RequestHandler):
+    def post(self):
+        """Update the search documents of Conferences/Sessions."""
+        fulltext.indexEntities([ndb.Key(urlsafe=wsk)
+                                for wsk in self.request.get_all('keys')])
+        self.response.set_status(204)
+
+
+class ReindexSearchHandler(CursorBatchHandler):
+    """
+    Index every Conference or Session (kind), to build the search
+    indexes from existing data.
+    """
+    BATCH_SIZE = fulltext.PUT_BATCH
+    KINDS = {'Conference': Conference, 'Session': Session}
+    PARAMS = ('kind',)
+
+    def query(self):
+        return self.KINDS[self.request.get('kind')].query()
+
+    def batch(self, keys):
+        fulltext.indexEntities(keys)
+
+
+class UpdateSpeakersHandler(webapp2.RequestHandler):
+    def post(self):
+        """Apply the changes of Session writes to the Speakers."""
+        speakers.applyChanges(json.loads(self.request.body))
+        self.response.set_status(204)
+
+
+class RebuildSpeakersHandler(CursorBatchHandler):
+    """Add every Session to its Speaker, to build the speaker index."""
+    # sessions without a speaker aren't in the projection, nor the index
+    FETCH_OPTIONS = {'projection': [Session.speaker]}
+
+    def query(self):
+        return Session.query()
+
+    def batch(self, sessions):
+        speakers.applyChanges([[session.speaker, session.key.urlsafe(), 1]
+                               for session in sessions])
+
+
+class BulkImportUrlHandler(webapp2.RequestHandler):
+    def get(self):
+        """
+        Return the URL to upload an import file to, as the 'file' field
+        of a multipart POST with 'kind' and 'format' fields.
+        """
+        writeJson(self.response,
+                  {'uploadUrl': blobstore.create_upload_url('/bulk/import')})
+
+
+class BulkImportHandler(blobstore_handlers.BlobstoreUploadHandler):
+    def post(self):
+        """Start importing an uploaded file; redirect to its progress."""
+        uploads = self.get_uploads('file')
+        if not uploads:
+            self.abort(400, 'No file uploaded')
+        try:
+            job = bulk.startImport(self.request.get('kind'),
+                                   self.request.get('format'),
+                                   uploads[0].key())
+        except ValueError as e:
+            blobstore.delete(uploads[0].key())
+            self.abort(400, str(e))
+        self.redirect('/bulk/jobs?job=%d' % job.key.id())
+
+
+class BulkExportHandler(webapp2.RequestHandler):
+    def post(self):
+        """Start exporting a kind ('kind', 'format' fields)."""
+        try:
+            job = bulk.startExport(self.request.get('kind'),
+                                   self.request.get('format'))
+        except ValueError as e:
+            self.abort(400, str(e))
+        writeJson(self.response, bulk.progress(job))
+
+
+class BulkJobHandler(webapp2.RequestHandler):
+    def get(self):
+        """Return the progress of an import or export ('job')."""
+        job = BulkJob.get_by_id(int(self.request.get('job') or 0))
+        if not job:
+            self.abort(404)
+        writeJson(self.response, bulk.progress(job))
+
+
+class BulkExportPartHandler(webapp2.RequestHandler):
+    def get(self):
+        """
+        Return a part ('part', from 1) of an export ('job'); the file is
+        the parts concatenated in order.
+        """
+        found = bulk.exportPart(int(self.request.get('job') or 0),
+                                int(self.request.get('part') or 0))
+        if not found:
+            self.abort(404)
+        content_type, data = found
+        self.response.headers['Content-Type'] = content_type
+        self.response.write(data)
+
+
+class BulkStepHandler(webapp2.RequestHandler):
+    def post(self):
+        """Run one batch of an import or export job."""
+        bulk.runStep(int(self.request.get('job')),
+                     int(self.request.get('step')))
+        self.response.set_status(204)
+
+
+class EndpointStatsHandler(webapp2.RequestHandler):
+    def get(self):
+        """Dump the per-endpoint cost stats, hottest endpoints first."""
+        names = ['ConferenceApi.%s' % name
+                 for name in ConferenceApi.all_remote_methods()]
+        names.extend(route[0] for route in ROUTES)
+        limit = self.request.get('limit')
+        writeJson(self.response, {
+            'endpoints': instrumentation.endpointStats(
+                names, int(limit) if limit else None),
+            'confcache': confcache.stats(),
+            'querycache': querycache.stats(),
+            'confirmation_emails': notifications.stats(),
+        })
+
+ROUTES = [
     ('/crons/set_announcement', SetAnnouncementHandler),
+    ('/crons/fold_wishlists', FoldWishlistsHandler),
+    ('/crons/fold_stats', FoldStatsHandler),
+    ('/crons/send_confirmation_emails', SendConfirmationEmailsHandler),
     ('/tasks/send_confirmation_email', SendConfirmationEmailHandler),
-    ('/tasks/set_Featured_Speaker', SetFeaturedSpeaker)
-], debug=True)
+    ('/tasks/send_confirmation_emails', SendConfirmationEmailsHandler),
+    ('/tasks/set_Featured_Speaker', SetFeaturedSpeaker),
+    ('/tasks/fold_seats', FoldSeatsHandler),
+    ('/tasks/adjust_seats', AdjustSeatsHandler),
+    ('/tasks/migrate_registrations', MigrateRegistrationsHandler),
+    ('/tasks/migrate_wishlists', MigrateWishlistsHandler),
+    ('/tasks/update_organizer_name', UpdateOrganizerNameHandler),
+    ('/tasks/index_documents', IndexDocumentsHandler),
+    ('/tasks/reindex_search', ReindexSearchHandler),
+    ('/tasks/update_speakers', UpdateSpeakersHandler),
+    ('/tasks/rebuild_speakers', RebuildSpeakersHandler),
+    ('/tasks/bulk_step', BulkStepHandler),
+    ('/bulk/import_url', BulkImportUrlHandler),
+    ('/bulk/import', BulkImportHandler),
+    ('/bulk/export', BulkExportHandler),
+    ('/bulk/export_part', BulkExportPartHandler),
+    ('/bulk/jobs', BulkJobHandler),
+    ('/debug/endpoint_stats', EndpointStatsHandler),
+]
+
+app = instrumentation.Middleware(webapp2.WSGIApplication(ROUTES, debug=True))
@@ -0,0 +1,118 @@
+#!/usr/bin/env python
+
+"""
+mappers.py -- precompiled entity to ProtoRPC form copying
+
+A FormMapper works out once, at import, which form fields come from
+which model properties and how each value is converted, so that copying
+an entity is a straight run over a tuple instead of an all_fields() scan
+with hasattr/getattr/setattr and enum lookups by name for every row.
+
+"""
+
+import copy
+
+from models import Conference
+from models import ConferenceForm
+from models import ConferenceSummaryForm
+from models import Profile
+from models import ProfileForm
+from models import Session
+from models import SessionForm
+from models import SessionSlotForm
+from models import SessionSummaryForm
+from models import TeeShirtSize
+from models import TypeOfSession
+
+
+def enumConverter(enum_type):
+    """Return a function mapping a stored enum name to its enum value."""
+    values = dict((value.name, value) for value in enum_type)
+    return values.__getitem__
+
+
+class FormMapper(object):
+    """Copies the entities of one model to one form message class."""
+
+    def __init__(self, model, form, converters=None, extras=None, exclude=()):
+        """
+        converters map a field name to a function of the property value;
+        extras map a field name to a function of the entity, for fields
+        that are not model properties.
+        """
+        converters = converters or {}
+        names = [field.name for field in form.all_fields()
+                 if field.name in model._properties and field.name not in exclude]
+        self.form = form
+        self.properties = tuple(names)
+        self.plain = tuple(name for name in names if name not in converters)
+        self.converted = tuple((name, converters[name])
+                               for name in names if name in converters)
+        self.extras = tuple((extras or {}).items())
+
+    def withValues(self, fixed):
+        """
+        Return a mapper that takes the properties in fixed (name -> value)
+        from there for every entity, e.g. properties pinned by an equality
+        filter, which a projection query can't return.
+        """
+        fixed = dict((name, value) for name, value in fixed.items()
+                     if name in self.properties)
+        converters = dict(self.converted)
+        for name in fixed:
+            if name in converters:
+                fixed[name] = converters[name](fixed[name])
+        mapper = copy.copy(self)
+        mapper.plain = tuple(name for name in self.plain if name not in fixed)
+        mapper.converted = tuple((name, convert) for name, convert
+                                 in self.converted if name not in fixed)
+        mapper.extras = self.extras + tuple(
+            (name, lambda entity, value=value: value)
+            for name, value in fixed.items())
+        return mapper
+
+    def copy(self, entity):
+        """Return the form of one entity."""
+        values = {}
+        for name in self.plain:
+            value = getattr(entity, name)
+            if value is not None:
+                values[name] = value
+        for name, convert in self.converted:
+            values[name] = convert(getattr(entity, name))
+        for name, compute in self.extras:
+            values[name] = compute(entity)
+        return self.form(**values)
+
+    def copyMany(self, entities):
+        """Return the forms of entities, in order."""
+        copy = self.copy
+        return [copy(entity) for entity in entities]
+
+
+CONFERENCE = FormMapper(Conference, ConferenceForm,
+    # dates go out as date strings
+    converters={'startDate': str, 'endDate': str},
+    extras={'websafeKey': lambda conf: conf.key.urlsafe()})
+
+SESSION = FormMapper(Session, SessionForm,
+    converters={'typeOfSession': enumConverter(TypeOfSession)})
+
+CONFERENCE_SUMMARY = FormMapper(Conference, ConferenceSummaryForm,
+    converters={'startDate': str},
+    extras={'websafeKey': lambda conf: conf.key.urlsafe()},
+    # not projected: a projection skips the Conferences stored without
+    # it; the names are resolved after the fetch
+    exclude=('organizerDisplayName',))
+
+SESSION_SUMMARY = FormMapper(Session, SessionSummaryForm,
+    converters={'typeOfSession': enumConverter(TypeOfSession)})
+
+SESSION_SLOT = FormMapper(Session, SessionSlotForm,
+    converters={'typeOfSession': enumConverter(TypeOfSession)},
+    extras={'websafeSessionKey': lambda session: session.key.urlsafe()})
+
+PROFILE = FormMapper(Profile, ProfileForm,
+    converters={'teeShirtSize': enumConverter(TeeShirtSize)},
+    # filled in from the Registrations and wishlistKeys
+    exclude=('conferenceKeysToAttend', 'wishlist'))
@@ -16,7 +16,6 @@ import httplib
 import endpoints
 from protorpc import messages
 from google.appengine.ext import ndb
-from collections import Counter
 
 class ConflictException(endpoints.ServiceException):
     """ConflictException -- exception mapped to HTTP 409 response"""
@@ -24,11 +23,83 @@ class ConflictException(endpoints.ServiceException):
 
 class Profile(ndb.Model):
     """Profile -- User profile object"""
+    # read on every authed request; keep a short-lived copy in memcache,
+    # which ndb drops on every put
+    _memcache_timeout = 300
+
     displayName = ndb.StringProperty()
     mainEmail = ndb.StringProperty()
     teeShirtSize = ndb.StringProperty(default='NOT_SPECIFIED')
+    # legacy, moved to Registration entities by Registration.migrateProfile
     conferenceKeysToAttend = ndb.StringProperty(repeated=True)
+    # legacy websafe keys, moved to wishlistKeys by Profile.migrateWishlist
     wishlist = ndb.StringProperty(repeated=True)
+    wishlistKeys = ndb.KeyProperty(kind='Session', repeated=True)
+
+    @classmethod
+    @ndb.transactional()
+    def migrateWishlist(cls, prof_key):
+        """
+        Move Profile.wishlist to Profile.wishlistKeys, returning the
+        wishlistKeys.
+        """
+        prof = prof_key.get()
+        if not prof:
+            return []
+        if prof.wishlist:
+            for s_key in (ndb.Key(urlsafe=wssk) for wssk in prof.wishlist):
+                if s_key not in prof.wishlistKeys:
+                    prof.wishlistKeys.append(s_key)
+            prof.wishlist = []
+            prof.put()
+        return prof.wishlistKeys
+
+class Registration(ndb.Model):
+    """
+    Registration -- a Profile attending a Conference. Child of the Profile
+    with the websafe Conference key as id, so membership is a key lookup.
+    """
+    conference = ndb.KeyProperty(kind='Conference')
+
+    @classmethod
+    def keyFor(cls, prof_key, conf_key):
+        """Return the Registration key of a profile for a conference."""
+        return ndb.Key(cls, conf_key.urlsafe(), parent=prof_key)
+
+    @classmethod
+    @ndb.tasklet
+    def conferenceKeysAsync(cls, prof_key):
+        """Return the keys of the conferences a profile attends."""
+        keys = yield cls.query(ancestor=prof_key).fetch_async(keys_only=True)
+        raise ndb.Return([ndb.Key(urlsafe=key.id()) for key in keys])
+
+    @classmethod
+    def conferenceKeys(cls, prof_key):
+        """Return the keys of the conferences a profile attends."""
+        return cls.conferenceKeysAsync(prof_key).get_result()
+
+    @classmethod
+    def attendeesQuery(cls, conf_key):
+        """Return a keys-only-ready query of a conference's Registrations."""
+        return cls.query(cls.conference == conf_key)
+
+    @classmethod
+    @ndb.transactional()
+    def migrateProfile(cls, prof_key):
+        """
+        Move Profile.conferenceKeysToAttend to Registration entities,
+        returning the number of registrations moved.
+        """
+        prof = prof_key.get()
+        if not prof or not prof.conferenceKeysToAttend:
+            return 0
+        conf_keys = set(ndb.Key(urlsafe=wsck)
+                        for wsck in prof.conferenceKeysToAttend)
+        regs = [cls(key=cls.keyFor(prof_key, conf_key), conference=conf_key)
+                for conf_key in conf_keys]
+        prof.conferenceKeysToAttend = []
+        ndb.put_multi(regs + [prof])
+        return len(regs)
 
 class ProfileMiniForm(messages.Message):
     """ProfileMiniForm -- update Profile form message"""
@@ -43,6 +114,11 @@ class ProfileForm(messages.Message):
     conferenceKeysToAttend = messages.StringField(4, repeated=True)
     wishlist = messages.StringField(5, repeated=True)
 
+class AttendeeForms(messages.Message):
+    """AttendeeForms -- attendees of a Conference outbound form message"""
+    displayNames = messages.StringField(1, repeated=True)
+    nextPageToken = messages.StringField(2)
+
 class StringMessage(messages.Message):
     """StringMessage-- outbound (single) string message"""
     data = messages.StringField(1, required=True)
@@ -63,6 +139,32 @@ class Conference(ndb.Model):
     endDate         = ndb.DateProperty()
     maxAttendees    = ndb.IntegerProperty()
     seatsAvailable  = ndb.IntegerProperty()
+    seatShards      = ndb.IntegerProperty(default=0, indexed=False)
+    # the organizer Profile's displayName, see Conference.renameOrganizer
+    organizerDisplayName = ndb.StringProperty()
+
+    @classmethod
+    @ndb.transactional()
+    def renameOrganizer(cls, conf_keys, name):
+        """
+        Set organizerDisplayName of Conferences of one organizer (one
+        entity group), returning the keys of those that changed.
+        """
+        confs = [conf for conf in ndb.get_multi(conf_keys)
+                 if conf and conf.organizerDisplayName != name]
+        for conf in confs:
+            conf.organizerDisplayName = name
+        ndb.put_multi(confs)
+        return [conf.key for conf in confs]
+
+class SeatShard(ndb.Model):
+    """
+    SeatShard -- one slice of the available seats of a Conference.
+    Root entity so that registrations on different shards don't contend.
+    """
+    seatsAvailable  = ndb.IntegerProperty(default=0, indexed=False)
+    # [[adjustment id, seats added], ...] of the latest adjustSeats calls
+    adjustments     = ndb.JsonProperty(indexed=False)
 
 class ConferenceForm(messages.Message):
     """ConferenceForm -- Conference outbound form message"""
@@ -79,9 +181,30 @@ class ConferenceForm(messages.Message):
     websafeKey      = messages.StringField(11)
     organizerDisplayName = messages.StringField(12)
 
+class ConferenceSummaryForm(messages.Message):
+    """ConferenceSummaryForm -- Conference list card outbound form message"""
+    name            = messages.StringField(1)
+    city            = messages.StringField(2)
+    startDate       = messages.StringField(3) #DateTimeField()
+    maxAttendees    = messages.IntegerField(4)
+    seatsAvailable  = messages.IntegerField(5)
+    organizerUserId = messages.StringField(6)
+    organizerDisplayName = messages.StringField(7)
+    websafeKey      = messages.StringField(8)
+
 class ConferenceForms(messages.Message):
-    """ConferenceForms -- multiple Conference outbound form message"""
+    """
+    ConferenceForms -- multiple Conference outbound form message
+    Carries summaries instead of items for the SUMMARY view
+    """
     items = messages.MessageField(ConferenceForm, 1, repeated=True)
+    nextPageToken = messages.StringField(2)
+    summaries = messages.MessageField(ConferenceSummaryForm, 3, repeated=True)
+
+class View(messages.Enum):
+    """View -- how much of each entity a list response carries"""
+    FULL = 1
+    SUMMARY = 2
 
 class TeeShirtSize(messages.Enum):
     """TeeShirtSize -- t-shirt size enumeration value"""
@@ -110,6 +233,9 @@ class ConferenceQueryForm(messages.Message):
 class ConferenceQueryForms(messages.Message):
     """ConferenceQueryForms -- multiple ConferenceQueryForm inbound form message"""
     filters = messages.MessageField(ConferenceQueryForm, 1, repeated=True)
+    pageSize = messages.IntegerField(2)
+    pageToken = messages.StringField(3)
+    view = messages.EnumField('View', 4, default='FULL')
 
 class Session(ndb.Model):
     """Session -- Session object"""
@@ -122,19 +248,196 @@ class Session(ndb.Model):
     startTime       = ndb.IntegerProperty()
     wishlisted      = ndb.IntegerProperty(default=0)
 
+class SpeakerIndex(ndb.Model):
+    """
+    SpeakerIndex -- speaker -> session names of a Conference. Child of the
+    Conference so it can be updated in the same transaction as its Sessions.
+    """
+    # {normalized speaker: [session names]}, see Speaker.normalize
+    speakers = ndb.JsonProperty(indexed=False)
+    # {normalized speaker: the first spelling seen}; None in indexes
+    # from before speakers were normalized
+    names = ndb.JsonProperty(indexed=False)
+
+    @classmethod
+    def keyFor(cls, conf_key):
+        """Return the SpeakerIndex key of a conference."""
+        return ndb.Key(cls, 1, parent=conf_key)
+
     @classmethod
-    def countspeakers(self, conf_key):
+    def build(cls, conf_key):
+        """Build the (unsaved) index of a conference from its Sessions."""
+        index = cls(key=cls.keyFor(conf_key), speakers={}, names={})
+        for session in Session.query(ancestor=conf_key,
+                projection=[Session.speaker, Session.name]):
+            index.add(session)
+        return index
+
+    @classmethod
+    def current(cls, index, conf_key):
+        """Return index, or a new one built if missing or not normalized."""
+        if index and index.names is not None:
+            return index
+        return cls.build(conf_key)
+
+    @classmethod
+    def forConference(cls, conf_key):
+        """Return the index of a conference, building it if missing."""
+        return cls.current(cls.keyFor(conf_key).get(), conf_key)
+
+    def add(self, session):
+        """Count a new (or updated) Session for its speaker."""
+        speaker = Speaker.normalize(session.speaker)
+        if speaker:
+            self.speakers.setdefault(speaker, []).append(session.name)
+            self.names.setdefault(speaker, ' '.join(session.speaker.split()))
+
+    def remove(self, session):
+        """Uncount a deleted (or the previous version of an updated) Session."""
+        speaker = Speaker.normalize(session.speaker)
+        names = self.speakers.get(speaker, [])
+        if session.name in names:
+            names.remove(session.name)
+            if not names:
+                del self.speakers[speaker]
+                self.names.pop(speaker, None)
+
+    def featured(self):
         """
-        Return the speaker and the number of sessions speaker is in
-        given a confence.
+        Return (speaker, session names) of the speaker in the most
+        sessions, None unless some speaker is in more than one.
         """
-        speakers = [session.speaker for session in self.query(ancestor=\
-                    conf_key, projection=[Session.speaker])]
-        # Returns array [('speakers name', 'number of session speaker is in' )]
-        speakerCount =  Counter(speakers)
-        return speakerCount.most_common(1)[0]
+        if not self.speakers:
+            return None
+        speaker = max(self.speakers, key=lambda sp: len(self.speakers[sp]))
+        if len(self.speakers[speaker]) < 2:
+            return None
+        return self.names.get(speaker, speaker), self.speakers[speaker]
 
 
+class Speaker(ndb.Model):
+    """
+    Speaker -- a speaker and the keys of their Sessions, across all
+    conferences. Keyed by the normalized name, see keyFor.
+    """
+    name        = ndb.StringProperty(indexed=False)
+    sessionKeys = ndb.KeyProperty(kind='Session', repeated=True, indexed=False)
+
+    @staticmethod
+    def normalize(name):
+        """Return name with whitespace collapsed and lowercased."""
+        return ' '.join((name or '').split()).lower()
+
+    @classmethod
+    def keyFor(cls, name):
+        """Return the Speaker key of a name, None for a blank name."""
+        normalized = cls.normalize(name)
+        return ndb.Key(cls, normalized) if normalized else None
+
+
+class NearlySoldOut(ndb.Model):
+    """
+    NearlySoldOut -- the conferences with few seats left, behind the
+    announcement; a single entity
+    """
+    # {websafe Conference key: Conference name}
+    conferences = ndb.JsonProperty(indexed=False)
+
+    @classmethod
+    def keyFor(cls):
+        """Return the key of the single NearlySoldOut entity."""
+        return ndb.Key(cls, 'nearly_sold_out')
+
+
+class WishlistLeaderboard(ndb.Model):
+    """
+    WishlistLeaderboard -- most wishlisted Sessions, either of all
+    conferences (id 'global') or of one (id websafe Conference key)
+    """
+    # [[websafe Session key, wishlisted], ...], most wishlisted first
+    entries = ndb.JsonProperty(indexed=False)
+
+    def merge(self, counts, size):
+        """
+        Merge new wishlisted counts by websafe Session key, keeping the
+        top size. Counts only grow, so the higher of two counts of a
+        Session is the newer.
+        """
+        merged = dict(self.entries or [])
+        for wssk, count in counts.items():
+            merged[wssk] = max(merged.get(wssk, 0), count)
+        top = sorted(merged.items(), key=lambda entry: -entry[1])[:size]
+        self.entries = [list(entry) for entry in top]
+
+    def sessionKeys(self):
+        """Return the Session keys on the board, most wishlisted first."""
+        return [ndb.Key(urlsafe=wssk) for wssk, count in self.entries or []]
+
+
+class FoldLog(ndb.Model):
+    """
+    FoldLog -- the pull tasks recently folded into an entity group, see
+    pullqueue.foldDeltas. Child of the group's root, with the queue name
+    as id.
+    """
+    # [[fold time, [task names]], ...], oldest first
+    folds = ndb.JsonProperty(indexed=False)
+
+
+class StatsRollup(ndb.Model):
+    """
+    StatsRollup -- summed statistics events of a Conference over one hour,
+    one day or all time. Child of the Conference, see keyFor.
+    """
+    # {metric: count}, see analytics.py
+    counts = ndb.JsonProperty(indexed=False)
+
+    PERIODS = {'hour': '%Y-%m-%dT%H', 'day': '%Y-%m-%d'}
+
+    @classmethod
+    def keyFor(cls, conf_key, period, when=None):
+        """
+        Return the key of the rollup of a conference for the 'hour' or
+        'day' containing the datetime when, or for the 'total'.
+        """
+        if period == 'total':
+            return ndb.Key(cls, 'total', parent=conf_key)
+        bucket = when.strftime(cls.PERIODS[period])
+        return ndb.Key(cls, '%s:%s' % (period, bucket), parent=conf_key)
+
+
+class BulkJob(ndb.Model):
+    """
+    BulkJob -- a bulk import or export of Conferences or Sessions, run
+    one batch per task; where it stopped is saved after every batch
+    """
+    operation   = ndb.StringProperty(choices=('import', 'export'))
+    kind        = ndb.StringProperty(choices=('Conference', 'Session'))
+    format      = ndb.StringProperty(choices=('ndjson', 'csv'))
+    status      = ndb.StringProperty(default='running')
+    # the number of batches done; a task for another step is stale
+    step        = ndb.IntegerProperty(default=0, indexed=False)
+    records     = ndb.IntegerProperty(default=0, indexed=False)
+    errors      = ndb.IntegerProperty(default=0, indexed=False)
+    lastError   = ndb.StringProperty(indexed=False)
+    # import: the uploaded file, the byte offset reached and the CSV columns
+    blobKey     = ndb.BlobKeyProperty()
+    offset      = ndb.IntegerProperty(default=0, indexed=False)
+    columns     = ndb.StringProperty(repeated=True, indexed=False)
+    # export: the query cursor reached and the number of BulkParts written
+    cursor      = ndb.StringProperty(indexed=False)
+    parts       = ndb.IntegerProperty(default=0, indexed=False)
+    created     = ndb.DateTimeProperty(auto_now_add=True)
+    updated     = ndb.DateTimeProperty(auto_now=True)
+
+
+class BulkPart(ndb.Model):
+    """
+    BulkPart -- one chunk of an export file. Child of the BulkJob, with
+    ids 1, 2, ... in file order.
+    """
+    data = ndb.BlobProperty()
+
 class SessionForm(messages.Message):
     """
     SessionForm -- Session outbound form message
@@ -160,9 +463,56 @@ class TypeOfSession(messages.Enum):
     EXHIBITION = 8
     PRESENTATIONS = 9
 
+class SessionSummaryForm(messages.Message):
+    """SessionSummaryForm -- Session list card outbound form message"""
+    name            = messages.StringField(1)
+    speaker         = messages.StringField(2)
+    typeOfSession   = messages.EnumField('TypeOfSession', 3)
+    startTime       = messages.IntegerField(4)
+    dayofConf       = messages.IntegerField(5)
+
 class SessionForms(messages.Message):
-    """SessionForms -- multiple Session outbound form message"""
+    """
+    SessionForms -- multiple Session outbound form message
+    Carries summaries instead of sessions for the SUMMARY view
+    """
     sessions = messages.MessageField(SessionForm, 1, repeated=True)
+    nextPageToken = messages.StringField(2)
+    summaries = messages.MessageField(SessionSummaryForm, 3, repeated=True)
+
+class SessionSlotForm(messages.Message):
+    """SessionSlotForm -- when and by whom a Session is, outbound form message"""
+    websafeSessionKey = messages.StringField(1)
+    name            = messages.StringField(2)
+    speaker         = messages.StringField(3)
+    typeOfSession   = messages.EnumField('TypeOfSession', 4)
+    dayofConf       = messages.IntegerField(5)
+    startTime       = messages.IntegerField(6)
+    duration        = messages.IntegerField(7)
+
+class SessionSlotForms(messages.Message):
+    """SessionSlotForms -- the slots of a conference's Sessions, by day and time"""
+    slots = messages.MessageField(SessionSlotForm, 1, repeated=True)
+
+class ScheduleItemForm(messages.Message):
+    """
+    ScheduleItemForm -- a wishlisted Session on a schedule, with the
+    wishlisted Sessions it overlaps and free alternatives to it
+    """
+    session = messages.MessageField(SessionSlotForm, 1)
+    conflictsWith = messages.StringField(2, repeated=True)
+    alternatives = messages.MessageField(SessionSlotForm, 3, repeated=True)
+
+class ScheduleDayForm(messages.Message):
+    """ScheduleDayForm -- one day of a conference on a schedule"""
+    websafeConferenceKey = messages.StringField(1)
+    dayofConf = messages.IntegerField(2)
+    items = messages.MessageField(ScheduleItemForm, 3, repeated=True)
+
+class ScheduleForm(messages.Message):
+    """ScheduleForm -- the wishlisted Sessions of a user by day, outbound form message"""
+    days = messages.MessageField(ScheduleDayForm, 1, repeated=True)
+    conflicts = messages.IntegerField(2)
 
 class SessionQueryForm(messages.Message):
     """SessionQueryForm -- Session query inbound form message"""
@@ -170,13 +520,58 @@ class SessionQueryForm(messages.Message):
     operator = messages.StringField(2)
     value = messages.StringField(3)
 
+class SearchForm(messages.Message):
+    """
+    SearchForm -- full-text search inbound form message
+    websafeConferenceKey limits a session search to one conference
+    """
+    query = messages.StringField(1, required=True)
+    pageSize = messages.IntegerField(2)
+    pageToken = messages.StringField(3)
+    websafeConferenceKey = messages.StringField(4)
+
 class SpeakerSessionQueryForm(messages.Message):
     """SpeakerSessionQueryForm -- Session query inbound form message"""
     speaker = messages.StringField(1)
+    view = messages.EnumField('View', 2, default='FULL')
 
 class SessionQueryForms(messages.Message):
     """SessionQueryForms -- multiple SessionQueryForm inbound form message"""
     filters = messages.MessageField(SessionQueryForm, 1, repeated=True)
+    pageSize = messages.IntegerField(2)
+    pageToken = messages.StringField(3)
+    view = messages.EnumField('View', 4, default='FULL')
+
+class SpeakerForm(messages.Message):
+    """SpeakerForm -- Speaker outbound form message"""
+    name = messages.StringField(1)
+    sessionCount = messages.IntegerField(2)
+
+class SpeakerForms(messages.Message):
+    """SpeakerForms -- multiple Speaker outbound form message"""
+    speakers = messages.MessageField(SpeakerForm, 1, repeated=True)
+    nextPageToken = messages.StringField(2)
+
+class StatCountForm(messages.Message):
+    """StatCountForm -- one count of a ConferenceStatsForm breakdown"""
+    label = messages.StringField(1)
+    count = messages.IntegerField(2)
+
+class ConferenceStatsForm(messages.Message):
+    """ConferenceStatsForm -- Conference statistics outbound form message"""
+    name                = messages.StringField(1)
+    maxAttendees        = messages.IntegerField(2)
+    seatsAvailable      = messages.IntegerField(3)
+    fillRate            = messages.FloatField(4)
+    registrations       = messages.IntegerField(5)
+    sessions            = messages.IntegerField(6)
+    wishlists           = messages.IntegerField(7)
+    registrationsHourly = messages.MessageField(StatCountForm, 8, repeated=True)
+    registrationsDaily  = messages.MessageField(StatCountForm, 9, repeated=True)
+    sessionsByType      = messages.MessageField(StatCountForm, 10, repeated=True)
+    sessionsByDay       = messages.MessageField(StatCountForm, 11, repeated=True)
+    wishlistsByType     = messages.MessageField(StatCountForm, 12, repeated=True)
+    wishlistsByDay      = messages.MessageField(StatCountForm, 13, repeated=True)
 
 class FeatureSpeaker(messages.Message):
     """FeatureSpeaker -- FeatureSpeaker outbound form message """
@@ -0,0 +1,132 @@
+#!/usr/bin/env python
+
+"""
+notifications.py -- batched conference confirmation emails
+
+Creating a conference adds a pull task whose payload is just the
+conference key, and schedules at most one named worker task per
+SEND_INTERVAL. The worker leases the pending tasks in bulk, renders each
+mail from the Conference and its organizer's Profile, and sends at most
+MAX_SENDS_PER_SECOND. A task whose send fails stays leased and is retried
+when its lease expires, up to MAX_ATTEMPTS times. Sent, failed and
+dropped mails and the time spent sending are counted in memcache.
+
+"""
+
+import logging
+import time
+
+from google.appengine.api import app_identity
+from google.appengine.api import mail
+from google.appengine.api import memcache
+from google.appengine.api import taskqueue
+from google.appengine.ext import ndb
+
+import pullqueue
+
+CONFIRMATION_QUEUE = 'confirmation-emails'
+SEND_INTERVAL = 10  # seconds
+LEASE_SECONDS = 120
+LEASE_BATCH = 100
+MAX_SENDS_PER_SECOND = 5
+MAX_ATTEMPTS = 5
+STATS_PREFIX = 'CONFIRMATION_EMAILS_'
+COUNTERS = ('sent', 'failed', 'dropped', 'batches', 'send_ms')
+
+
+def enqueueConfirmation(conf_key):
+    """Queue the confirmation mail of a newly created conference."""
+    pullqueue.add(CONFIRMATION_QUEUE, conf_key.urlsafe())
+    scheduleSend()
+
+
+def scheduleSend():
+    """Run the batch sender once per SEND_INTERVAL."""
+    interval = int(time.time() / SEND_INTERVAL)
+    try:
+        taskqueue.add(url='/tasks/send_confirmation_emails',
+                      name='send-confirmations-%d' % interval,
+                      countdown=SEND_INTERVAL)
+    except (taskqueue.TaskAlreadyExistsError, taskqueue.TombstonedTaskError):
+        pass
+
+
+def renderConfirmation(conf):
+    """Return the (subject, body) of the confirmation mail of a conference."""
+    details = '\r\n'.join('%s: %s' % (label, value) for label, value in (
+        ('Name', conf.name),
+        ('Description', conf.description or ''),
+        ('City', conf.city or ''),
+        ('Topics', ', '.join(conf.topics)),
+        ('Start date', conf.startDate or ''),
+        ('End date', conf.endDate or ''),
+        ('Seats', conf.maxAttendees or 0),
+    ))
+    return ('You created a new Conference!',
+            'Hi, you have created a following conference:\r\n\r\n%s' % details)
+
+
+def sendConfirmations(send=None, max_per_second=MAX_SENDS_PER_SECOND):
+    """
+    Send one leased batch of confirmation mails through send(sender, to,
+    subject, body), mail.send_mail unless given (e.g. a stub in tests).
+    Return the number of tasks leased.
+    """
+    return pullqueue.fold(
+        CONFIRMATION_QUEUE,
+        lambda tasks: _sendBatch(tasks, send or mail.send_mail,
+                                 max_per_second),
+        LEASE_SECONDS, LEASE_BATCH)
+
+
+def _sendBatch(tasks, send, max_per_second):
+    """Send the mails of leased tasks, returning the tasks done with."""
+    conf_keys = [ndb.Key(urlsafe=task.payload) for task in tasks]
+    confs = ndb.get_multi(conf_keys)
+    # the organizer's Profile is the parent of the Conference
+    profiles = ndb.get_multi([conf_key.parent() for conf_key in conf_keys])
+    sender = 'noreply@%s.appspotmail.com' % app_identity.get_application_id()
+
+    done, counts = [], dict((counter, 0) for counter in COUNTERS)
+    min_gap = 1.0 / max_per_second
+    last_send = 0
+    start = time.time()
+    for task, conf, prof in zip(tasks, confs, profiles):
+        if not conf:
+            done.append(task)
+            continue
+        # user ids are emails unless getUserId() is set up otherwise
+        to = prof.mainEmail if prof and prof.mainEmail else conf.organizerUserId
+        subject, body = renderConfirmation(conf)
+        wait = last_send + min_gap - time.time()
+        if wait > 0:
+            time.sleep(wait)
+        last_send = time.time()
+        try:
+            send(sender, to, subject, body)
+        except Exception:
+            logging.exception('Confirmation mail of %s failed', task.payload)
+            if task.retry_count + 1 >= MAX_ATTEMPTS:
+                done.append(task)
+                counts['dropped'] += 1
+            else:
+                counts['failed'] += 1
+            continue
+        done.append(task)
+        counts['sent'] += 1
+    counts['send_ms'] = int((time.time() - start) * 1000)
+    counts['batches'] = 1
+
+    memcache.offset_multi(counts, key_prefix=STATS_PREFIX, initial_value=0)
+    # failed tasks stay leased, and are retried when the lease expires
+    return done
+
+
+def stats():
+    """Return the counters and the send throughput (mails/second)."""
+    counts = memcache.get_multi(COUNTERS, key_prefix=STATS_PREFIX)
+    counts = dict((counter, counts.get(counter, 0)) for counter in COUNTERS)
+    counts['sent_per_second'] = round(
+        counts['sent'] * 1000.0 / counts['send_ms'], 2) \
+        if counts['send_ms'] else None
+    return counts
@@ -0,0 +1,116 @@
+#!/usr/bin/env python
+
+"""
+planner.py -- session query planning with in-memory post-filtering
+
+The datastore takes inequality filters on one property per query only,
+and runs != as an OR of sub-queries. plan() pushes the equality filters
+and the inequalities of the one property estimated to be the most
+selective to the datastore, and returns the other filters as predicates.
+fetchPage() applies those to the streamed results, scanning a bounded
+number of entities per page, so any combination of filters works at a
+predictable cost.
+
+"""
+
+import operator
+
+from google.appengine.ext import ndb
+
+COMPARATORS = {
+    '=':  operator.eq,
+    '>':  operator.gt,
+    '>=': operator.ge,
+    '<':  operator.lt,
+    '<=': operator.le,
+    '!=': operator.ne,
+}
+
+# value ranges of the numeric Session properties; the fraction of its
+# range an inequality keeps estimates its selectivity
+DOMAINS = {
+    'startTime': (0, 24),
+    'duration': (0, 480),
+    'dayofConf': (1, 10),
+}
+DEFAULT_SELECTIVITY = 0.5  # inequalities on strings
+
+MAX_SCAN = 1000  # most entities scanned for one page
+SCAN_BATCH = 100
+
+
+def selectivity(name, filters):
+    """Estimate the fraction of entities the (op, value) filters on name keep."""
+    if name not in DOMAINS:
+        return DEFAULT_SELECTIVITY
+    low, high = DOMAINS[name]
+    lower, upper = low, high
+    for op, value in filters:
+        if op in ('>', '>='):
+            lower = max(lower, value)
+        elif op in ('<', '<='):
+            upper = min(upper, value)
+    return max(0.0, float(upper - lower)) / (high - low)
+
+
+def plan(query, filters, order=()):
+    """
+    Plan a query for (property, op, value) filters. Return (query,
+    predicates): query with the equality filters and the inequalities of
+    the most selective property applied, ordered by that property and
+    then by the properties of order; and the filters left to apply in
+    memory, as (property, comparator, value).
+    """
+    inequalities = {}
+    for name, op, value in filters:
+        # != would become an OR of sub-queries; always filter it in memory
+        if op not in ('=', '!='):
+            inequalities.setdefault(name, []).append((op, value))
+    pushed = min(inequalities, key=lambda name: selectivity(
+        name, inequalities[name])) if inequalities else None
+
+    predicates = []
+    for name, op, value in filters:
+        if op == '=' or name == pushed:
+            query = query.filter(ndb.query.FilterNode(name, op, value))
+        else:
+            predicates.append((name, COMPARATORS[op], value))
+
+    if pushed:
+        query = query.order(ndb.GenericProperty(pushed))
+    for name in order:
+        if name != pushed:
+            query = query.order(ndb.GenericProperty(name))
+    return query, predicates
+
+
+def matches(entity, predicates):
+    """Return whether an entity passes every predicate."""
+    for name, compare, value in predicates:
+        if not compare(getattr(entity, name), value):
+            return False
+    return True
+
+
+def fetchPage(query, predicates, page_size, cursor=None, max_scan=MAX_SCAN):
+    """
+    Return (entities, next_cursor) for one page of the query results that
+    pass predicates. At most max_scan entities are read; a page cut short
+    by that is returned with a cursor to continue from. next_cursor is
+    None once the results are exhausted.
+    """
+    results = []
+    it = query.iter(start_cursor=cursor, produce_cursors=True,
+                    batch_size=min(max_scan, SCAN_BATCH))
+    scanned = 0
+    for entity in it:
+        scanned += 1
+        if matches(entity, predicates):
+            results.append(entity)
+        if len(results) == page_size or scanned == max_scan:
+            break
+    else:
+        return results, None
+    if not it.probably_has_next():
+        return results, None
+    return results, it.cursor_after()
@@ -0,0 +1,111 @@
+#!/usr/bin/env python
+
+"""
+pullqueue.py -- events buffered on pull queues and folded in batches
+
+A write adds its event as a pull task, transactionally when it runs in a
+transaction, so the event is buffered only if the write commits. A fold
+leases a batch of tasks, hands them to a function and deletes the tasks
+that function reports done; tasks left leased come back when their lease
+expires. Used by notifications.py.
+
+A task can thus be leased again after a fold already used it: the fold
+failed before deleting it, or ran longer than its lease. foldDeltas adds
+tasks to entities so that this doesn't count them twice. The entities of
+an entity group are updated in one transaction, which also records the
+names of the tasks it added in a FoldLog of the group, and skips those
+recorded by earlier folds. Used by leaderboard.py and analytics.py.
+
+"""
+
+import time
+
+from google.appengine.api import taskqueue
+from google.appengine.ext import ndb
+
+from models import FoldLog
+
+LEASE_SECONDS = 60
+LEASE_BATCH = 1000  # most tasks lease_tasks returns at once
+# how long folded task names are kept; a task whose fold failed is leased
+# again once its lease expires, well within this
+LOG_SECONDS = 10 * 60
+
+
+def add(queue_name, payload):
+    """Buffer one event; transactional inside a transaction."""
+    taskqueue.Queue(queue_name).add(
+        taskqueue.Task(payload=payload, method='PULL'),
+        transactional=ndb.in_transaction())
+
+
+def fold(queue_name, process, lease_seconds=LEASE_SECONDS,
+         batch=LEASE_BATCH):
+    """
+    Lease up to batch tasks and pass them to process(tasks), which
+    returns the tasks it is done with, or None for all of them. Delete
+    those, and return the number of tasks leased.
+    """
+    queue = taskqueue.Queue(queue_name)
+    tasks = queue.lease_tasks(lease_seconds, batch)
+    if not tasks:
+        return 0
+    done = process(tasks)
+    done = tasks if done is None else done
+    if done:
+        queue.delete_tasks(done)
+    return len(tasks)
+
+
+def foldDeltas(queue_name, deltas, apply, lease_seconds=LEASE_SECONDS,
+               batch=LEASE_BATCH):
+    """
+    Lease up to batch tasks and add them to entities, each task once.
+    deltas(tasks) returns {entity key: [(task name, delta), ...]}, and
+    apply(key, entity, [delta, ...]) the entity, None if missing, with
+    the deltas of tasks not added yet added, or None to leave it out.
+    Delete the tasks, and return (the number of tasks leased, the
+    entities as they are after the fold).
+    """
+    queue = taskqueue.Queue(queue_name)
+    tasks = queue.lease_tasks(lease_seconds, batch)
+    if not tasks:
+        return 0, []
+    groups = {}
+    for key, task_deltas in deltas(tasks).items():
+        groups.setdefault(key.root(), {})[key] = task_deltas
+    # the groups are updated concurrently, and any failure leaves every
+    # task leased to be folded again
+    futures = [_foldGroupAsync(queue_name, group, apply)
+               for group in groups.values()]
+    entities = [entity for future in futures for entity in future.get_result()]
+    queue.delete_tasks(tasks)
+    return len(tasks), entities
+
+
+@ndb.transactional_tasklet()
+def _foldGroupAsync(queue_name, group, apply):
+    """Fold the deltas of the entities of one entity group, see foldDeltas."""
+    keys = list(group)
+    log_key = ndb.Key(FoldLog, queue_name, parent=keys[0].root())
+    found = yield ndb.get_multi_async(keys + [log_key])
+    log = found.pop() or FoldLog(key=log_key, folds=[])
+    folded = set(name for at, names in log.folds for name in names)
+
+    entities, changed, names = [], [], set()
+    for key, entity in zip(keys, found):
+        new = [(name, delta) for name, delta in group[key]
+               if name not in folded]
+        if new:
+            entity = apply(key, entity, [delta for name, delta in new])
+            if entity is not None:
+                changed.append(entity)
+                names.update(name for name, delta in new)
+        if entity is not None:
+            entities.append(entity)
+    if changed:
+        now = int(time.time())
+        log.folds = [fold for fold in log.folds
+                     if fold[0] > now - LOG_SECONDS] + [[now, sorted(names)]]
+        yield ndb.put_multi_async(changed + [log])
+    raise ndb.Return(entities)
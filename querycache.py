@@ -0,0 +1,76 @@
+#!/usr/bin/env python
+
+"""
+querycache.py -- memcache of queryConferences result pages
+
+A page is cached under its canonical query: the filters normalized the
+way the query reads them and sorted, plus the page size, page token and
+view, hashed into an entry of a confcache.VersionedCache with a single
+scope. Any write that can change
+which conferences a query returns, or what their forms show, bumps that
+scope, dropping every cached page at once.
+
+"""
+
+import hashlib
+import json
+
+from confcache import VersionedCache
+
+ENTRY_TTL = 600  # seconds
+SCOPE = 'all'
+INTEGER_FIELDS = ('month', 'maxAttendees')  # filtered as ints
+
+_cache = VersionedCache('CONF_QUERY_', ENTRY_TTL)
+
+
+def canonicalFilters(filters):
+    """
+    Return formatted filters (dicts of field, operator, value) in a
+    canonical form: values of INTEGER_FIELDS as ints, as _getQuery
+    filters them, duplicates dropped, sorted. Other values are kept as
+    given, since the query compares them exactly.
+    """
+    canonical = []
+    for f in filters:
+        value = f['value']
+        if f['field'] in INTEGER_FIELDS:
+            try:
+                value = int(value)  # '06' and '6' are the same month
+            except ValueError:
+                pass
+        canonical.append((f['field'], f['operator'], value))
+    # frozenset, as this module's set() shadows the builtin
+    return sorted(frozenset(canonical))
+
+
+def entryKey(filters, page_size, page_token, view):
+    """
+    Return the key of a page under the current version. Take it before
+    running the query, so that a write racing with the query leaves the
+    stale page under the old version.
+    """
+    query = json.dumps([canonicalFilters(filters), page_size, page_token,
+                        str(view)])
+    return _cache.entryKey(SCOPE,
+                           hashlib.md5(query.encode('utf-8')).hexdigest())
+
+
+def get(entry_key, message_type):
+    """Return the cached page, None on a miss."""
+    return _cache.get(entry_key, message_type)
+
+
+def set(entry_key, message):
+    """Cache a page under a key from entryKey()."""
+    _cache.set(entry_key, message)
+
+
+def bump():
+    """Drop every cached page."""
+    _cache.bump(SCOPE)
+
+
+def stats():
+    """Return the hit and miss counters and the hit rate."""
+    return _cache.stats()
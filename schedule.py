@@ -0,0 +1,118 @@
+#!/usr/bin/env python
+
+"""
+schedule.py -- a user's schedule built from their wishlist
+
+Works from the slots (SessionSlotForms) of each conference, sorted by day
+and start time, which conference.py caches per conference. The wishlisted
+slots of each day are swept in start order to find the overlapping ones;
+free alternatives to a conflicting session (same speaker first, then same
+type) are checked against the day's merged busy intervals by bisection.
+
+"""
+
+import heapq
+from bisect import bisect_right
+
+MAX_ALTERNATIVES = 3
+MINUTES_PER_DAY = 24 * 60
+
+
+def interval(slot):
+    """Return the (start, end) minutes of a slot since its day began."""
+    start = (slot.startTime or 0) * 60
+    return start, start + (slot.duration or 0)
+
+
+def sortSlots(slots):
+    """Return slots in timeline order: by day, start time and name."""
+    return sorted(slots, key=lambda slot: (slot.dayofConf or 0,
+                                           slot.startTime or 0, slot.name))
+
+
+def findConflicts(slots):
+    """
+    Return {websafeSessionKey: [websafeSessionKey, ...]} of the slots of
+    one day that overlap, by sweeping them in start order.
+    """
+    conflicts = {}
+    active = []  # heap of (end, websafeSessionKey) of the slots still running
+    for slot in sorted(slots, key=interval):
+        start, end = interval(slot)
+        while active and active[0][0] <= start:
+            heapq.heappop(active)
+        for other_end, other in active:
+            conflicts.setdefault(slot.websafeSessionKey, []).append(other)
+            conflicts.setdefault(other, []).append(slot.websafeSessionKey)
+        heapq.heappush(active, (end, slot.websafeSessionKey))
+    return conflicts
+
+
+def busyIntervals(slots):
+    """Return the merged (start, end) intervals the slots of a day take."""
+    merged = []
+    for start, end in sorted(interval(slot) for slot in slots):
+        if merged and start < merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], end)
+        else:
+            merged.append([start, end])
+    return merged
+
+
+def isFree(slot, busy, busy_starts):
+    """Return whether a slot overlaps none of the busy intervals of its day."""
+    start, end = interval(slot)
+    # the only candidates are the interval starting last before end
+    i = bisect_right(busy_starts, end - 1) - 1 if end > start \
+        else bisect_right(busy_starts, start) - 1
+    return i < 0 or busy[i][1] <= start
+
+
+def alternatives(slot, conf_slots, wishlisted, busy_by_day):
+    """
+    Return up to MAX_ALTERNATIVES slots of the conference that are not
+    wishlisted, free on their day, and by the same speaker or of the
+    same type as slot; same speaker first.
+    """
+    speaker = [s for s in conf_slots if slot.speaker and s.speaker == slot.speaker]
+    same_type = [s for s in conf_slots if s.typeOfSession == slot.typeOfSession]
+    found, seen = [], set()
+    for candidate in speaker + same_type:
+        key = candidate.websafeSessionKey
+        if key in wishlisted or key in seen:
+            continue
+        seen.add(key)
+        busy, busy_starts = busy_by_day.get(candidate.dayofConf, ([], []))
+        if isFree(candidate, busy, busy_starts):
+            found.append(candidate)
+            if len(found) == MAX_ALTERNATIVES:
+                break
+    return found
+
+
+def buildDays(wishlisted_slots, conf_slots):
+    """
+    Return [(dayofConf, [(slot, conflicting keys, alternatives), ...])]
+    for the wishlisted slots of one conference, conf_slots being all of
+    its slots in timeline order.
+    """
+    by_day = {}
+    for slot in sortSlots(wishlisted_slots):
+        by_day.setdefault(slot.dayofConf, []).append(slot)
+    busy_by_day = {}
+    for day, slots in by_day.items():
+        busy = busyIntervals(slots)
+        busy_by_day[day] = (busy, [start for start, end in busy])
+    wishlisted = set(slot.websafeSessionKey for slot in wishlisted_slots)
+
+    days = []
+    for day in sorted(by_day):
+        conflicts = findConflicts(by_day[day])
+        items = []
+        for slot in by_day[day]:
+            conflicting = conflicts.get(slot.websafeSessionKey, [])
+            items.append((slot, conflicting, alternatives(
+                slot, conf_slots, wishlisted, busy_by_day)
+                if conflicting else []))
+        days.append((day, items))
+    return days
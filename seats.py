@@ -0,0 +1,189 @@
+#!/usr/bin/env python
+
+"""
+seats.py -- sharded seat allocation for conference registration
+
+Seats of a Conference are split across SeatShard root entities so that
+concurrent registrations for the same conference land on different entity
+groups. A shard never goes below zero, so the conference cannot be
+oversold. Conference.seatsAvailable is refreshed from the shards by the
+/tasks/fold_seats task, scheduled at most once per FOLD_INTERVAL.
+
+"""
+
+import random
+import time
+
+from google.appengine.api import taskqueue
+from google.appengine.ext import ndb
+
+import analytics
+import announcement
+import confcache
+import querycache
+from models import ConflictException
+from models import Registration
+from models import SeatShard
+
+NUM_SEAT_SHARDS = 20
+MAX_ADJUSTMENTS = 20  # adjustment ids remembered per shard
+FOLD_INTERVAL = 10  # seconds
+
+
+def shardKeys(conf_key, num_shards):
+    """Return the SeatShard keys of a conference."""
+    wsck = conf_key.urlsafe()
+    return [ndb.Key(SeatShard, '%s:%d' % (wsck, i))
+            for i in range(num_shards)]
+
+
+def makeSeatShards(conf_key, seats):
+    """
+    Split seats across new SeatShard entities, returning the (unsaved)
+    shards. The caller stores len(shards) in Conference.seatShards.
+    """
+    num_shards = max(1, min(NUM_SEAT_SHARDS, seats))
+    keys = shardKeys(conf_key, num_shards)
+    per_shard, extra = divmod(seats, num_shards)
+    return [SeatShard(key=key,
+                      seatsAvailable=per_shard + (1 if i < extra else 0))
+            for i, key in enumerate(keys)]
+
+
+@ndb.transactional(xg=True)
+def initSeatShards(conf_key):
+    """
+    Shard the seats of a conference created before seat sharding,
+    returning the number of shards. Safe to call concurrently.
+    """
+    conf = conf_key.get()
+    if not conf.seatShards:
+        shards = makeSeatShards(conf_key, conf.seatsAvailable or 0)
+        conf.seatShards = len(shards)
+        ndb.put_multi(shards + [conf])
+    return conf.seatShards
+
+
+def _shardsInRandomOrder(conf):
+    """Return the shard keys of a conference, sharding it if needed."""
+    num_shards = conf.seatShards or initSeatShards(conf.key)
+    keys = shardKeys(conf.key, num_shards)
+    random.shuffle(keys)
+    return keys
+
+
+@ndb.transactional(xg=True)
+def _takeSeat(shard_key, conf_key, reg_key):
+    """Take one seat from a shard for a Registration, False if shard is empty."""
+    shard, reg = ndb.get_multi([shard_key, reg_key])
+    if reg:
+        raise ConflictException(
+            "You have already registered for this conference")
+    if not shard or shard.seatsAvailable <= 0:
+        return False
+    shard.seatsAvailable -= 1
+    ndb.put_multi([shard, Registration(key=reg_key, conference=conf_key)])
+    analytics.recordEvents([analytics.registrationEvent(conf_key, 1)])
+    return True
+
+
+@ndb.transactional(xg=True)
+def _returnSeat(shard_key, reg_key):
+    """Give a Registration's seat back to a shard, False if not registered."""
+    shard, reg = ndb.get_multi([shard_key, reg_key])
+    if not reg:
+        return False
+    shard.seatsAvailable += 1
+    shard.put()
+    reg_key.delete()
+    analytics.recordEvents([analytics.registrationEvent(reg.conference, -1)])
+    return True
+
+
+def reserveSeat(conf, prof_key):
+    """
+    Register a profile for a conference, trying shards in random order
+    until one has a seat left. Raise ConflictException if sold out.
+    """
+    reg_key = Registration.keyFor(prof_key, conf.key)
+    for shard_key in _shardsInRandomOrder(conf):
+        if _takeSeat(shard_key, conf.key, reg_key):
+            scheduleFold(conf.key)
+            return True
+    raise ConflictException("There are no seats available.")
+
+
+def releaseSeat(conf, prof_key):
+    """Unregister a profile from a conference, False if not registered."""
+    shard_key = _shardsInRandomOrder(conf)[0]
+    released = _returnSeat(shard_key, Registration.keyFor(prof_key, conf.key))
+    if released:
+        scheduleFold(conf.key)
+    return released
+
+
+def adjustSeats(conf_key, delta, adjustment_id):
+    """
+    Add (or, with a negative delta, remove) seats across the shards of a
+    conference, e.g. after maxAttendees changed. Seats already taken are
+    never removed. Each shard records adjustment_id (e.g. the task name)
+    with its change, so a retried adjustment is applied only once.
+    """
+    conf = conf_key.get()
+    # the same order on every retry, so the same shards are adjusted
+    keys = shardKeys(conf_key, conf.seatShards or initSeatShards(conf_key))
+
+    @ndb.transactional()
+    def adjust(shard_key, wanted):
+        shard = shard_key.get()
+        applied = dict(shard.adjustments or [])
+        if adjustment_id in applied:
+            return applied[adjustment_id]
+        change = max(wanted, -shard.seatsAvailable)
+        shard.seatsAvailable += change
+        shard.adjustments = (shard.adjustments or [])[1 - MAX_ADJUSTMENTS:] + \
+            [[adjustment_id, change]]
+        shard.put()
+        return change
+
+    if delta > 0:
+        adjust(keys[0], delta)
+    else:
+        for shard_key in keys:
+            if not delta:
+                break
+            delta -= adjust(shard_key, delta)
+    scheduleFold(conf_key)
+
+
+def scheduleFold(conf_key):
+    """Fold the shards into the conference once per FOLD_INTERVAL."""
+    interval = int(time.time() / FOLD_INTERVAL)
+    try:
+        taskqueue.add(url='/tasks/fold_seats',
+                      name='fold-seats-%s-%d' % (conf_key.urlsafe(), interval),
+                      params={'key': conf_key.urlsafe()},
+                      countdown=FOLD_INTERVAL)
+    except (taskqueue.TaskAlreadyExistsError, taskqueue.TombstonedTaskError):
+        pass
+
+
+def foldSeats(conf_key):
+    """Write the sum of the shards to Conference.seatsAvailable."""
+    conf = conf_key.get()
+    if not conf or not conf.seatShards:
+        return
+    shards = ndb.get_multi(shardKeys(conf_key, conf.seatShards))
+    seats = sum(shard.seatsAvailable for shard in shards if shard)
+
+    @ndb.transactional()
+    def fold():
+        conf = conf_key.get()
+        if conf.seatsAvailable != seats:
+            conf.seatsAvailable = seats
+            conf.put()
+            return True
+    if fold():
+        confcache.invalidate(conf_key)
+        querycache.bump()
+        announcement.refresh(conf_key.urlsafe(), conf.name, seats)
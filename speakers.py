@@ -0,0 +1,73 @@
+#!/usr/bin/env python
+
+"""
+speakers.py -- the speaker -> sessions index
+
+Each Speaker entity lists the keys of the Sessions of one speaker, under
+the speaker's normalized name, so "Jane  Doe" and "jane doe" are the same
+speaker and their sessions are a single keyed lookup away. Session writes
+enqueue their changes to the index (transactionally inside a transaction),
+and a task applies them in one small transaction per Speaker. Adding and
+removing a session are idempotent, so retried tasks and rebuilds are safe.
+
+"""
+
+import json
+
+from google.appengine.api import taskqueue
+from google.appengine.ext import ndb
+
+from models import Speaker
+
+UPDATE_TASK_URL = '/tasks/update_speakers'
+
+
+def enqueueChanges(sessions, removed=(), name=None):
+    """
+    Update the index for new/updated sessions and for the previous
+    versions of updated sessions and deleted sessions (removed), in a
+    task, named name if given; transactional inside a transaction.
+    """
+    changes = [[session.speaker, session.key.urlsafe(), -1]
+               for session in removed if session.speaker]
+    changes.extend([session.speaker, session.key.urlsafe(), 1]
+                   for session in sessions if session.speaker)
+    if changes:
+        taskqueue.add(url=UPDATE_TASK_URL, payload=json.dumps(changes),
+                      name=name, transactional=ndb.in_transaction())
+
+
+@ndb.transactional()
+def _update(sp_key, name, changes):
+    """Apply (Session key, +1/-1) changes to one Speaker."""
+    speaker = sp_key.get() or Speaker(key=sp_key, name=name)
+    for s_key, delta in changes:
+        if delta > 0 and s_key not in speaker.sessionKeys:
+            speaker.sessionKeys.append(s_key)
+        elif delta < 0 and s_key in speaker.sessionKeys:
+            speaker.sessionKeys.remove(s_key)
+    if speaker.sessionKeys:
+        speaker.put()
+    else:
+        sp_key.delete()
+
+
+def applyChanges(changes):
+    """Apply [speaker name, websafe Session key, +1/-1] changes, in order."""
+    by_speaker, names = {}, {}
+    for name, wssk, delta in changes:
+        sp_key = Speaker.keyFor(name)
+        if sp_key:
+            by_speaker.setdefault(sp_key, []).append(
+                (ndb.Key(urlsafe=wssk), delta))
+            # the first spelling seen names a new Speaker
+            names.setdefault(sp_key, ' '.join(name.split()))
+    for sp_key, speaker_changes in by_speaker.items():
+        _update(sp_key, names[sp_key], speaker_changes)
+
+
+def sessionKeys(name):
+    """Return the Session keys of a speaker, by any spelling of the name."""
+    sp_key = Speaker.keyFor(name)
+    speaker = sp_key.get() if sp_key else None
+    return speaker.sessionKeys if speaker else []
@@ -249,7 +249,7 @@ conferenceApp.controllers.controller('CreateConferenceCtrl',
  * @description
  * A controller used for the Show conferences page.
  */
-conferenceApp.controllers.controller('ShowConferenceCtrl', function ($scope, $log, oauth2Provider, HTTP_ERRORS) {
+conferenceApp.controllers.controller('ShowConferenceCtrl', function ($scope, $log, $window, oauth2Provider, HTTP_ERRORS) {
 
     /**
      * Holds the status if the query is being executed.
@@ -293,6 +293,18 @@ conferenceApp.controllers.controller('ShowConferenceCtrl', function ($scope, $lo
      */
     $scope.conferences = [];
 
+    /**
+     * Holds the token of the next page of the 'ALL' query, null when there are no more pages.
+     * @type {string}
+     */
+    $scope.nextPageToken = null;
+
+    /**
+     * Holds the filters sent with the first page, reused when loading the following pages.
+     * @type {{}}
+     */
+    $scope.sentFilters = null;
+
     /**
      * Holds the state if offcanvas is enabled.
      *
@@ -425,20 +437,32 @@ conferenceApp.controllers.controller('ShowConferenceCtrl', function ($scope, $lo
 
     /**
      * Invokes the conference.queryConferences API.
+     *
+     * @param loadMore if true, appends the next page of the previous query instead of starting a new one.
      */
-    $scope.queryConferencesAll = function () {
+    $scope.queryConferencesAll = function (loadMore) {
         var sendFilters = {
-            filters: []
+            filters: [],
+            pageSize: $scope.pagination.pageSize,
+            // the list only shows the conference summaries
+            view: 'SUMMARY'
         }
-        for (var i = 0; i < $scope.filters.length; i++) {
-            var filter = $scope.filters[i];
-            if (filter.field && filter.operator && filter.value) {
-                sendFilters.filters.push({
-                    field: filter.field.enumValue,
-                    operator: filter.operator.enumValue,
-                    value: filter.value
-                });
+        if (loadMore) {
+            sendFilters.filters = $scope.sentFilters.filters;
+            sendFilters.pageToken = $scope.nextPageToken;
+        } else {
+            for (var i = 0; i < $scope.filters.length; i++) {
+                var filter = $scope.filters[i];
+                if (filter.field && filter.operator && filter.value) {
+                    sendFilters.filters.push({
+                        field: filter.field.enumValue,
+                        operator: filter.operator.enumValue,
+                        value: filter.value
+                    });
+                }
             }
+            $scope.sentFilters = sendFilters;
+            $scope.nextPageToken = null;
         }
         $scope.loading = true;
         gapi.client.conference.queryConferences(sendFilters).
@@ -458,16 +482,42 @@ conferenceApp.controllers.controller('ShowConferenceCtrl', function ($scope, $lo
                         $scope.alertStatus = 'success';
                         $log.info($scope.messages);
 
-                        $scope.conferences = [];
-                        angular.forEach(resp.items, function (conference) {
+                        if (!loadMore) {
+                            $scope.conferences = [];
+                        }
+                        angular.forEach(resp.summaries, function (conference) {
                             $scope.conferences.push(conference);
                         });
+                        $scope.nextPageToken = resp.nextPageToken || null;
                     }
                     $scope.submitted = true;
                 });
             });
     }
 
+    /**
+     * Loads the next page of the 'ALL' query, if there is one and no query is running.
+     */
+    $scope.loadMoreConferences = function () {
+        if ($scope.selectedTab == 'ALL' && $scope.nextPageToken && !$scope.loading) {
+            $scope.queryConferencesAll(true);
+        }
+    };
+
+    /**
+     * Loads the next page when the user scrolls close to the bottom of the page.
+     */
+    var onScroll = function () {
+        var scrolled = $window.pageYOffset + $window.innerHeight;
+        if (scrolled >= $window.document.body.offsetHeight - 100) {
+            $scope.$apply($scope.loadMoreConferences);
+        }
+    };
+    angular.element($window).on('scroll', onScroll);
+    $scope.$on('$destroy', function () {
+        angular.element($window).off('scroll', onScroll);
+    });
+
     /**
      * Invokes the conference.getConferencesCreated method.
      */
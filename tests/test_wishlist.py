@@ -0,0 +1,71 @@
+#!/usr/bin/env python
+
+"""
+test_wishlist.py -- wishlist tests against the App Engine stubs
+
+usage: APPENGINE_SDK=PATH_TO_SDK python -m unittest discover tests
+
+"""
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'benchmarks'))
+
+import harness
+
+SDK = os.environ.get('APPENGINE_SDK')
+EMAIL = 'user@gmail.com'
+
+
+@unittest.skipUnless(SDK, 'set APPENGINE_SDK to the App Engine SDK path')
+class WishlistTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        harness.setupSdk(SDK)
+
+    def setUp(self):
+        self.testbed = harness.activateTestbed()
+        harness.signIn(EMAIL)
+
+    def tearDown(self):
+        self.testbed.deactivate()
+
+    def testLegacyWishlistedSessionIsNotAddedAgain(self):
+        import endpoints
+        from google.appengine.ext import ndb
+        import analytics
+        import conference
+        import leaderboard
+        from models import Conference
+        from models import Profile
+        from models import Session
+
+        conf_key = ndb.Key(Profile, 'organizer@gmail.com', Conference, 1)
+        Conference(key=conf_key, name='Conference',
+                   organizerUserId='organizer@gmail.com').put()
+        s_key = Session(parent=conf_key, name='Session').put()
+        p_key = ndb.Key(Profile, EMAIL)
+        Profile(key=p_key, displayName='user', mainEmail=EMAIL,
+                wishlist=[s_key.urlsafe()]).put()
+
+        request = conference.WISHLIST_POST_REQUEST.combined_message_class(
+            websafeSessionsKey=s_key.urlsafe())
+        with self.assertRaises(endpoints.NotFoundException):
+            conference.ConferenceApi().addSessionToWishlist(request)
+
+        ndb.get_context().clear_cache()
+        profile = p_key.get()
+        self.assertEqual(profile.wishlistKeys, [s_key])
+        self.assertEqual(profile.wishlist, [])
+        # nor was the wishlisting counted
+        taskqueue = self.testbed.get_stub('taskqueue')
+        self.assertEqual(taskqueue.GetTasks(leaderboard.WISHLIST_QUEUE), [])
+        self.assertEqual(taskqueue.GetTasks(analytics.STATS_QUEUE), [])
+
+
+if __name__ == '__main__':
+    unittest.main()